@@ -2,56 +2,29 @@
 API Key management endpoints.
 """
 from typing import List, Optional
-from datetime import datetime, timezone
+from datetime import timezone
 from fastapi import APIRouter, HTTPException, Query, Depends
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import ORJSONResponse
 
 from app.models.api_key import (
     APIKey, APIKeyCreate, APIKeyUpdate, APIKeyWithSecret,
-    APIKeyListResponse, APIKeyResponse, APIKeyCreateResponse,
-    APIKeyStats, APIKeyUsageLog
+    APIKeyResponse, APIKeyCreateResponse, APIKeyStats
 )
 from app.db.api_key_queries import (
     APIKeyQueries, APIKeyAssistantQueries, APIKeyUsageLogQueries
 )
-from app.db.queries import AssistantQueries
+from app.core.apikey_cache import apikey_cache, key_access_cache
+from app.core.auth import api_key_auth, manage_auth
+from app.core.cache_control import cache_control
 from app.utils.datetime_utils import parse_datetime
 
 router = APIRouter()
-security = HTTPBearer()
-
-
-async def get_current_api_key(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
-    """Get current API key from authorization header."""
-    api_key = credentials.credentials
-    key_hash = APIKeyQueries.hash_api_key(api_key)
-    
-    key_record = await APIKeyQueries.get_api_key_by_hash(key_hash)
-    if not key_record:
-        raise HTTPException(status_code=401, detail="Invalid API key")
-    
-    if key_record["is_disabled"]:
-        raise HTTPException(status_code=401, detail="API key is disabled")
-    
-    # 使用不带时区的 datetime 进行比较，与数据库保持一致
-    now = datetime.utcnow()
-    if key_record["expires_at"] and key_record["expires_at"] < now:
-        raise HTTPException(status_code=401, detail="API key has expired")
-    
-    return key_record
-
-
-async def require_manage_permission(current_key: dict = Depends(get_current_api_key)) -> dict:
-    """Require management permission."""
-    if not current_key["can_manage"]:
-        raise HTTPException(status_code=403, detail="Management permission required")
-    return current_key
 
 
 @router.post("/api-keys", response_model=APIKeyCreateResponse)
 async def create_api_key(
     key_data: APIKeyCreate,
-    current_key: dict = Depends(require_manage_permission)
+    current_key: dict = Depends(manage_auth)
 ):
     """Create a new API key."""
     try:
@@ -64,7 +37,10 @@ async def create_api_key(
             created_by=current_key.get("name", "unknown"),
             expires_at=key_data.expires_at
         )
-        
+
+        # 新建的 Key 通常很快就会被使用，预先写入缓存
+        apikey_cache.set(key_record["key_hash"], key_record)
+
         # Bind assistants if specified
         if key_data.assistant_ids:
             await APIKeyAssistantQueries.set_key_assistants(
@@ -87,21 +63,22 @@ async def create_api_key(
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@router.get("/api-keys", response_model=APIKeyListResponse)
+@router.get("/api-keys", response_model=None)
 async def list_api_keys(
     include_disabled: bool = Query(False, description="Include disabled keys"),
-    current_key: dict = Depends(require_manage_permission)
+    current_key: dict = Depends(manage_auth)
 ):
     """List all API keys."""
     try:
         keys = await APIKeyQueries.list_api_keys(include_disabled)
         
-        return APIKeyListResponse(
-            success=True,
-            message="API keys retrieved successfully",
-            data=[APIKey(**key) for key in keys],
-            total=len(keys)
-        )
+        # 查询只返回公开列，直接序列化，不再逐条构造模型
+        return ORJSONResponse({
+            "success": True,
+            "message": "API keys retrieved successfully",
+            "data": keys,
+            "total": len(keys)
+        })
         
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -110,7 +87,7 @@ async def list_api_keys(
 @router.get("/api-keys/{key_id}", response_model=APIKeyResponse)
 async def get_api_key(
     key_id: int,
-    current_key: dict = Depends(require_manage_permission)
+    current_key: dict = Depends(manage_auth)
 ):
     """Get API key by ID."""
     try:
@@ -134,16 +111,11 @@ async def get_api_key(
 async def update_api_key(
     key_id: int,
     key_data: APIKeyUpdate,
-    current_key: dict = Depends(require_manage_permission)
+    current_key: dict = Depends(manage_auth)
 ):
     """Update API key."""
     try:
-        # Check if key exists
-        existing_key = await APIKeyQueries.get_api_key_by_id(key_id)
-        if not existing_key:
-            raise HTTPException(status_code=404, detail="API key not found")
-        
-        # Update the key
+        # Update the key (returns None if the key does not exist)
         updated_key = await APIKeyQueries.update_api_key(
             api_key_id=key_id,
             name=key_data.name,
@@ -152,12 +124,16 @@ async def update_api_key(
             is_disabled=key_data.is_disabled,
             expires_at=key_data.expires_at
         )
+        if not updated_key:
+            raise HTTPException(status_code=404, detail="API key not found")
+        apikey_cache.invalidate(updated_key["key_hash"])
         
         # Update assistant bindings if specified
         if key_data.assistant_ids is not None:
             await APIKeyAssistantQueries.set_key_assistants(
                 key_id, key_data.assistant_ids
             )
+            key_access_cache.invalidate_key(key_id)
         
         return APIKeyResponse(
             success=True,
@@ -174,22 +150,19 @@ async def update_api_key(
 @router.delete("/api-keys/{key_id}")
 async def delete_api_key(
     key_id: int,
-    current_key: dict = Depends(require_manage_permission)
+    current_key: dict = Depends(manage_auth)
 ):
     """Delete API key."""
     try:
-        # Check if key exists
-        existing_key = await APIKeyQueries.get_api_key_by_id(key_id)
-        if not existing_key:
-            raise HTTPException(status_code=404, detail="API key not found")
-        
         # Prevent self-deletion
-        if existing_key["id"] == current_key["id"]:
+        if key_id == current_key["id"]:
             raise HTTPException(status_code=400, detail="Cannot delete your own API key")
         
-        success = await APIKeyQueries.delete_api_key(key_id)
-        if not success:
-            raise HTTPException(status_code=400, detail="Failed to delete API key")
+        key_hash = await APIKeyQueries.delete_api_key(key_id)
+        if not key_hash:
+            raise HTTPException(status_code=404, detail="API key not found")
+        apikey_cache.invalidate(key_hash)
+        key_access_cache.invalidate_key(key_id)
         
         return {
             "success": True,
@@ -205,16 +178,13 @@ async def delete_api_key(
 @router.get("/api-keys/{key_id}/assistants")
 async def get_key_assistants(
     key_id: int,
-    current_key: dict = Depends(require_manage_permission)
+    current_key: dict = Depends(manage_auth)
 ):
     """Get assistants bound to an API key."""
     try:
-        # Check if key exists
-        existing_key = await APIKeyQueries.get_api_key_by_id(key_id)
-        if not existing_key:
-            raise HTTPException(status_code=404, detail="API key not found")
-        
         assistants = await APIKeyAssistantQueries.get_key_assistants(key_id)
+        if assistants is None:
+            raise HTTPException(status_code=404, detail="API key not found")
         
         return {
             "success": True,
@@ -233,20 +203,17 @@ async def get_key_assistants(
 async def bind_assistant_to_key(
     key_id: int,
     assistant_id: int,
-    current_key: dict = Depends(require_manage_permission)
+    current_key: dict = Depends(manage_auth)
 ):
     """Bind an assistant to an API key."""
     try:
-        # Check if key and assistant exist
-        existing_key = await APIKeyQueries.get_api_key_by_id(key_id)
-        if not existing_key:
+        # Existence checks run in the same query as the insert
+        result = await APIKeyAssistantQueries.bind_assistant_to_key(key_id, assistant_id)
+        if not result["key_exists"]:
             raise HTTPException(status_code=404, detail="API key not found")
-        
-        assistant = await AssistantQueries.get_assistant_by_id(assistant_id)
-        if not assistant:
+        if not result["assistant_exists"]:
             raise HTTPException(status_code=404, detail="Assistant not found")
-        
-        await APIKeyAssistantQueries.bind_assistant_to_key(key_id, assistant_id)
+        key_access_cache.invalidate_key(key_id)
         
         return {
             "success": True,
@@ -263,13 +230,14 @@ async def bind_assistant_to_key(
 async def unbind_assistant_from_key(
     key_id: int,
     assistant_id: int,
-    current_key: dict = Depends(require_manage_permission)
+    current_key: dict = Depends(manage_auth)
 ):
     """Unbind an assistant from an API key."""
     try:
         success = await APIKeyAssistantQueries.unbind_assistant_from_key(key_id, assistant_id)
         if not success:
             raise HTTPException(status_code=404, detail="Binding not found")
+        key_access_cache.invalidate_key(key_id)
         
         return {
             "success": True,
@@ -286,16 +254,13 @@ async def unbind_assistant_from_key(
 async def get_key_stats(
     key_id: int,
     days: int = Query(30, ge=1, le=365, description="Number of days to analyze"),
-    current_key: dict = Depends(require_manage_permission)
+    current_key: dict = Depends(manage_auth)
 ):
     """Get usage statistics for an API key."""
     try:
-        # Check if key exists
-        existing_key = await APIKeyQueries.get_api_key_by_id(key_id)
-        if not existing_key:
-            raise HTTPException(status_code=404, detail="API key not found")
-        
         stats = await APIKeyUsageLogQueries.get_key_usage_stats(key_id, days)
+        if stats is None:
+            raise HTTPException(status_code=404, detail="API key not found")
         
         return {
             "success": True,
@@ -314,23 +279,20 @@ async def get_key_usage_logs(
     key_id: int,
     limit: int = Query(100, ge=1, le=1000, description="Number of logs to return"),
     offset: int = Query(0, ge=0, description="Number of logs to skip"),
-    current_key: dict = Depends(require_manage_permission)
+    current_key: dict = Depends(manage_auth)
 ):
     """Get usage logs for an API key."""
     try:
-        # Check if key exists
-        existing_key = await APIKeyQueries.get_api_key_by_id(key_id)
-        if not existing_key:
-            raise HTTPException(status_code=404, detail="API key not found")
-        
         logs = await APIKeyUsageLogQueries.get_key_usage_logs(key_id, limit, offset)
+        if logs is None:
+            raise HTTPException(status_code=404, detail="API key not found")
         
-        return {
+        return ORJSONResponse({
             "success": True,
             "message": "Usage logs retrieved successfully",
-            "data": [APIKeyUsageLog(**log) for log in logs],
+            "data": logs,
             "total": len(logs)
-        }
+        })
         
     except HTTPException:
         raise
@@ -339,7 +301,7 @@ async def get_key_usage_logs(
 
 
 @router.get("/my-key")
-async def get_my_key_info(current_key: dict = Depends(get_current_api_key)):
+async def get_my_key_info(current_key: dict = Depends(api_key_auth)):
     """Get information about the current API key."""
     return {
         "success": True,
@@ -348,18 +310,18 @@ async def get_my_key_info(current_key: dict = Depends(get_current_api_key)):
     }
 
 
-@router.get("/my-assistants")
-async def get_my_assistants(current_key: dict = Depends(get_current_api_key)):
+@router.get("/my-assistants", response_model=None)
+async def get_my_assistants(
+    current_key: dict = Depends(api_key_auth),
+    cache_headers: dict = Depends(cache_control(0))
+):
     """Get assistants accessible by the current API key."""
-    try:
-        assistants = await APIKeyAssistantQueries.get_key_assistants(current_key["id"])
-        
-        return {
-            "success": True,
-            "message": "Accessible assistants retrieved successfully",
-            "data": assistants,
-            "total": len(assistants)
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    assistants = await APIKeyAssistantQueries.get_key_assistants(current_key["id"]) or []
+    
+    # 数据库行已包含 Assistant 模型的全部字段，直接序列化，不再逐条构造模型
+    return ORJSONResponse({
+        "success": True,
+        "message": "Accessible assistants retrieved successfully",
+        "data": assistants,
+        "total": len(assistants)
+    }, headers=cache_headers)
@@ -1,22 +1,60 @@
 """
 Assistant management endpoints.
 """
+import asyncio
 import logging
-from typing import List, Optional
+from typing import Dict, List, Optional, Set
+
+import asyncpg
 from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi.responses import ORJSONResponse
 
 from app.models.assistant import (
-    Assistant, AssistantCreate, AssistantUpdate, AssistantWithTools,
-    AssistantListResponse, AssistantResponse, AssistantToolsResponse
+    AssistantCreate, AssistantUpdate, AssistantWithTools,
+    AssistantResponse, AssistantToolsResponse
 )
 from app.db.assistant_queries import AssistantQueries, AssistantToolQueries
-from app.db.queries import MCPToolQueries
 from app.core.auth import manage_auth
+from app.core.agent_manager import agent_manager
+from app.core.assistant_cache import assistant_name_cache
+from app.core.apikey_cache import key_access_cache
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# 修改后等待一段时间再刷新 agent，期间的连续修改合并为一次刷新
+AGENT_REFRESH_DELAY = 0.2
+
+_pending_refreshes: Dict[int, asyncio.Task] = {}  # assistant_id -> 等待中的刷新任务
+_running_refreshes: Set[asyncio.Task] = set()  # 持有正在执行的刷新任务的引用
+
+
+async def _refresh_agent_after_delay(assistant_id: int) -> None:
+    """Wait for edits to settle, then refresh the assistant's agent."""
+    await asyncio.sleep(AGENT_REFRESH_DELAY)
+    
+    # 开始刷新后不再可被取消，刷新期间到来的修改会再排一次刷新
+    task = _pending_refreshes.pop(assistant_id)
+    _running_refreshes.add(task)
+    try:
+        await agent_manager.refresh_agent(assistant_id)
+    except Exception as e:
+        # 即使刷新失败，也不影响已完成的修改
+        logger.warning(f"Failed to refresh agent for assistant {assistant_id}: {e}")
+    finally:
+        _running_refreshes.discard(task)
+
+
+def _schedule_agent_refresh(assistant_id: int) -> None:
+    """Schedule a debounced agent refresh, replacing any pending one."""
+    pending = _pending_refreshes.get(assistant_id)
+    if pending:
+        pending.cancel()
+    _pending_refreshes[assistant_id] = asyncio.create_task(
+        _refresh_agent_after_delay(assistant_id)
+    )
+
 
 @router.post("/assistants", response_model=AssistantResponse)
 async def create_assistant(
@@ -39,6 +77,7 @@ async def create_assistant(
             max_tools=assistant_data.max_tools,
             enabled=assistant_data.enabled
         )
+        assistant_name_cache.invalidate()
         
         # Add tools if provided (for dedicated assistants)
         if assistant_data.tool_ids and assistant_data.type == "dedicated":
@@ -61,7 +100,7 @@ async def create_assistant(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/assistants", response_model=AssistantListResponse)
+@router.get("/assistants", response_model=None)
 async def list_assistants(
     enabled_only: bool = Query(False, description="Only show enabled assistants"),
     current_key: dict = Depends(manage_auth)
@@ -70,12 +109,13 @@ async def list_assistants(
     try:
         assistants = await AssistantQueries.list_assistants(enabled_only)
         
-        return AssistantListResponse(
-            success=True,
-            message="Assistants retrieved successfully",
-            data=[Assistant(**assistant) for assistant in assistants],
-            total=len(assistants)
-        )
+        # 数据库行与 Assistant 模型字段一致，直接序列化，不再逐条构造模型
+        return ORJSONResponse({
+            "success": True,
+            "message": "Assistants retrieved successfully",
+            "data": assistants,
+            "total": len(assistants)
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -92,17 +132,6 @@ async def get_assistant(
         if not assistant:
             raise HTTPException(status_code=404, detail="Assistant not found")
         
-        # 确保 tools 字段是一个列表
-        if 'tools' in assistant and not isinstance(assistant['tools'], list):
-            import json
-            if isinstance(assistant['tools'], str):
-                try:
-                    assistant['tools'] = json.loads(assistant['tools'])
-                except json.JSONDecodeError:
-                    assistant['tools'] = []
-            else:
-                assistant['tools'] = []
-        
         return AssistantResponse(
             success=True,
             message="Assistant retrieved successfully",
@@ -123,44 +152,29 @@ async def update_assistant(
 ):
     """Update assistant."""
     try:
-        # Check if assistant exists
-        existing = await AssistantQueries.get_assistant_by_id(assistant_id)
-        if not existing:
-            raise HTTPException(status_code=404, detail="Assistant not found")
+        fields = assistant_data.model_dump(exclude={"tool_ids"})
         
-        # Check if name already exists (if changing name)
-        if assistant_data.name and assistant_data.name != existing["name"]:
-            name_check = await AssistantQueries.get_assistant_by_name(assistant_data.name)
-            if name_check:
-                raise HTTPException(status_code=400, detail="Assistant name already exists")
-        
-        # Update assistant
-        await AssistantQueries.update_assistant(
-            assistant_id=assistant_id,
-            name=assistant_data.name,
-            description=assistant_data.description,
-            type=assistant_data.type,
-            intent_model=assistant_data.intent_model,
-            max_tools=assistant_data.max_tools,
-            enabled=assistant_data.enabled
-        )
-        
-        # Update tools if provided
-        if assistant_data.tool_ids is not None:
-            await AssistantToolQueries.set_assistant_tools(
-                assistant_id, assistant_data.tool_ids
-            )
+        # 更新并返回带工具的助手只需一次往返；替换工具时与更新在同一语句中原子完成。
+        # 助手不存在时无返回行，重名由唯一约束拒绝
+        try:
+            if assistant_data.tool_ids is None:
+                result = await AssistantQueries.update_assistant_with_tools(
+                    assistant_id, **fields
+                )
+            else:
+                result = await AssistantQueries.update_assistant_and_tools(
+                    assistant_id, assistant_data.tool_ids, **fields
+                )
+        except asyncpg.UniqueViolationError:
+            raise HTTPException(status_code=400, detail="Assistant name already exists")
+        if not result:
+            raise HTTPException(status_code=404, detail="Assistant not found")
         
-        # Get updated assistant with tools
-        result = await AssistantQueries.get_assistant_with_tools(assistant_id)
+        # 名称或启用状态可能已变化
+        assistant_name_cache.invalidate()
         
-        # 刷新助手的 agent
-        try:
-            from app.api.v1.openai_compatible import refresh_assistant_agent
-            await refresh_assistant_agent(assistant_id)
-        except Exception as e:
-            # 即使刷新失败，也不影响更新操作
-            logger.warning(f"Failed to refresh agent for assistant {assistant_id}: {e}")
+        # 稍后在后台刷新助手的 agent
+        _schedule_agent_refresh(assistant_id)
         
         return AssistantResponse(
             success=True,
@@ -181,24 +195,17 @@ async def delete_assistant(
 ):
     """Delete assistant."""
     try:
-        # Check if assistant exists
-        existing = await AssistantQueries.get_assistant_by_id(assistant_id)
-        if not existing:
-            raise HTTPException(status_code=404, detail="Assistant not found")
-        
         # Delete assistant (will cascade delete assistant_tool relations)
         success = await AssistantQueries.delete_assistant(assistant_id)
         
         if not success:
-            raise HTTPException(status_code=500, detail="Failed to delete assistant")
+            raise HTTPException(status_code=404, detail="Assistant not found")
+        assistant_name_cache.invalidate()
+        # 绑定关系随助手级联删除
+        key_access_cache.invalidate_assistant(assistant_id)
         
-        # 刷新助手的 agent
-        try:
-            from app.api.v1.openai_compatible import refresh_assistant_agent
-            await refresh_assistant_agent(assistant_id)
-        except Exception as e:
-            # 即使刷新失败，也不影响删除操作
-            logger.warning(f"Failed to refresh agent for assistant {assistant_id}: {e}")
+        # 稍后在后台刷新助手的 agent
+        _schedule_agent_refresh(assistant_id)
         
         return {
             "success": True,
@@ -219,8 +226,7 @@ async def get_assistant_tools(
     """Get tools for an assistant."""
     try:
         # Check if assistant exists
-        existing = await AssistantQueries.get_assistant_by_id(assistant_id)
-        if not existing:
+        if not await AssistantQueries.exists(assistant_id):
             raise HTTPException(status_code=404, detail="Assistant not found")
         
         # Get tools
@@ -248,35 +254,22 @@ async def add_tool_to_assistant(
 ):
     """Add a tool to an assistant."""
     try:
-        # Check if assistant exists
-        assistant = await AssistantQueries.get_assistant_by_id(assistant_id)
-        if not assistant:
-            raise HTTPException(status_code=404, detail="Assistant not found")
-        
-        # Check if tool exists
-        tool = await MCPToolQueries.get_tool_by_id(tool_id)
-        if not tool:
-            raise HTTPException(status_code=404, detail="Tool not found")
-        
-        # Check if assistant is dedicated type
-        if assistant["type"] != "dedicated":
+        # Add tool to assistant (existence and type checks run in the same query)
+        result = await AssistantToolQueries.add_tool_to_assistant(
+            assistant_id, tool_id, priority
+        )
+        if not result["added"]:
+            if result["assistant_type"] is None:
+                raise HTTPException(status_code=404, detail="Assistant not found")
+            if not result["tool_exists"]:
+                raise HTTPException(status_code=404, detail="Tool not found")
             raise HTTPException(
                 status_code=400, 
                 detail="Tools can only be added to dedicated assistants"
             )
         
-        # Add tool to assistant
-        await AssistantToolQueries.add_tool_to_assistant(
-            assistant_id, tool_id, priority
-        )
-        
-        # 刷新助手的 agent
-        try:
-            from app.api.v1.openai_compatible import refresh_assistant_agent
-            await refresh_assistant_agent(assistant_id)
-        except Exception as e:
-            # 即使刷新失败，也不影响添加操作
-            logger.warning(f"Failed to refresh agent for assistant {assistant_id}: {e}")
+        # 稍后在后台刷新助手的 agent
+        _schedule_agent_refresh(assistant_id)
         
         return {
             "success": True,
@@ -298,8 +291,7 @@ async def remove_tool_from_assistant(
     """Remove a tool from an assistant."""
     try:
         # Check if assistant exists
-        assistant = await AssistantQueries.get_assistant_by_id(assistant_id)
-        if not assistant:
+        if not await AssistantQueries.exists(assistant_id):
             raise HTTPException(status_code=404, detail="Assistant not found")
         
         # Remove tool from assistant
@@ -313,13 +305,8 @@ async def remove_tool_from_assistant(
                 detail="Tool not found in assistant"
             )
         
-        # 刷新助手的 agent
-        try:
-            from app.api.v1.openai_compatible import refresh_assistant_agent
-            await refresh_assistant_agent(assistant_id)
-        except Exception as e:
-            # 即使刷新失败，也不影响移除操作
-            logger.warning(f"Failed to refresh agent for assistant {assistant_id}: {e}")
+        # 稍后在后台刷新助手的 agent
+        _schedule_agent_refresh(assistant_id)
         
         return {
             "success": True,
@@ -342,8 +329,7 @@ async def update_tool_priority(
     """Update tool priority for an assistant."""
     try:
         # Check if assistant exists
-        assistant = await AssistantQueries.get_assistant_by_id(assistant_id)
-        if not assistant:
+        if not await AssistantQueries.exists(assistant_id):
             raise HTTPException(status_code=404, detail="Assistant not found")
         
         # Update priority
@@ -357,13 +343,8 @@ async def update_tool_priority(
                 detail="Tool not found in assistant"
             )
         
-        # 刷新助手的 agent
-        try:
-            from app.api.v1.openai_compatible import refresh_assistant_agent
-            await refresh_assistant_agent(assistant_id)
-        except Exception as e:
-            # 即使刷新失败，也不影响更新操作
-            logger.warning(f"Failed to refresh agent for assistant {assistant_id}: {e}")
+        # 稍后在后台刷新助手的 agent
+        _schedule_agent_refresh(assistant_id)
         
         return {
             "success": True,
@@ -1,9 +1,10 @@
 """
 Health check endpoints.
 """
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Dict, Any
 
+from cachetools import TTLCache
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 
@@ -12,6 +13,27 @@ from app.db.connection import db_manager
 
 router = APIRouter()
 
+# 就绪检查要求存在的表
+REQUIRED_TABLES = ["mcp_tool", "tool_status", "assistant", "api_key"]
+
+# 探针请求频繁，短时间内复用数据库检查结果
+_db_status_cache: TTLCache = TTLCache(maxsize=1, ttl=settings.health_cache_ttl)
+# 表结构很少变化，就绪检查的建表结果缓存更久（只缓存成功结果）
+_schema_ready_cache: TTLCache = TTLCache(maxsize=1, ttl=settings.health_schema_cache_ttl)
+
+
+async def _check_database() -> str:
+    """Ping the database, reusing the result for a short interval."""
+    db_status = _db_status_cache.get("database")
+    if db_status is None:
+        try:
+            await db_manager.fetch_val("SELECT 1")
+            db_status = "healthy"
+        except Exception:
+            db_status = "unhealthy"
+        _db_status_cache["database"] = db_status
+    return db_status
+
 
 class HealthResponse(BaseModel):
     """Health check response model."""
@@ -34,16 +56,12 @@ class DetailedHealthResponse(BaseModel):
 @router.get("/health", response_model=HealthResponse)
 async def health_check():
     """Basic health check endpoint."""
-    try:
-        # Test database connection
-        await db_manager.fetch_val("SELECT 1")
-        db_status = "healthy"
-    except Exception:
-        db_status = "unhealthy"
+    # Test database connection
+    db_status = await _check_database()
     
     return HealthResponse(
         status="healthy" if db_status == "healthy" else "unhealthy",
-        timestamp=datetime.utcnow(),
+        timestamp=datetime.now(timezone.utc),
         version=settings.app_version,
         database=db_status,
         server_group=settings.server_group
@@ -54,11 +72,13 @@ async def health_check():
 async def detailed_health_check():
     """Detailed health check endpoint."""
     try:
-        # Test database connection and get info
-        db_version = await db_manager.fetch_val("SELECT version()")
+        # Test database connection; the server version is cached at connect time
+        await db_manager.fetch_val("SELECT 1")
+        if db_manager.server_version is None:
+            db_manager.server_version = await db_manager.fetch_val("SELECT version()")
         db_status = {
             "status": "healthy",
-            "version": db_version,
+            "version": db_manager.server_version,
             "url": settings.database_url.split("@")[-1] if "@" in settings.database_url else "unknown"
         }
     except Exception as e:
@@ -79,7 +99,7 @@ async def detailed_health_check():
     
     return DetailedHealthResponse(
         status=overall_status,
-        timestamp=datetime.utcnow(),
+        timestamp=datetime.now(timezone.utc),
         version=settings.app_version,
         database=db_status,
         configuration=config_info
@@ -91,23 +111,28 @@ async def readiness_check():
     """Readiness check endpoint."""
     try:
         # Check database connection
-        await db_manager.fetch_val("SELECT 1")
-        
-        # Check if required tables exist
-        tables_query = """
-            SELECT table_name FROM information_schema.tables 
-            WHERE table_schema = 'public' AND table_name IN 
-            ('server_group', 'mcp_tool', 'assistant', 'tool_status')
-        """
-        tables = await db_manager.fetch_all(tables_query)
-        
-        if len(tables) < 4:
+        if await _check_database() != "healthy":
             raise HTTPException(
                 status_code=503,
-                detail="Database tables not ready"
+                detail="Database not ready"
             )
         
-        return {"status": "ready", "timestamp": datetime.utcnow()}
+        # Check if required tables exist
+        if not _schema_ready_cache.get("tables"):
+            tables_query = """
+                SELECT count(*) FROM information_schema.tables 
+                WHERE table_schema = 'public' AND table_name = ANY($1::text[])
+            """
+            table_count = await db_manager.fetch_val(tables_query, REQUIRED_TABLES)
+            
+            if table_count < len(REQUIRED_TABLES):
+                raise HTTPException(
+                    status_code=503,
+                    detail="Database tables not ready"
+                )
+            _schema_ready_cache["tables"] = True
+        
+        return {"status": "ready", "timestamp": datetime.now(timezone.utc)}
         
     except Exception as e:
         raise HTTPException(
@@ -121,6 +146,6 @@ async def liveness_check():
     """Liveness check endpoint."""
     return {
         "status": "alive",
-        "timestamp": datetime.utcnow(),
+        "timestamp": datetime.now(timezone.utc),
         "version": settings.app_version
     }
@@ -1,18 +1,34 @@
 """
 MCP Tools management endpoints.
 """
-from typing import List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import asyncpg
+import orjson
 from fastapi import APIRouter, HTTPException, Query, Depends
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
 from app.models.mcp_tool import (
-    MCPTool, MCPToolCreate, MCPToolUpdate, MCPToolResponse, MCPToolListResponse
+    MCPTool, MCPToolCreate, MCPToolUpdate, MCPToolResponse
 )
 from app.db.queries import MCPToolQueries
+from app.core.tool_cache import tool_cache, get_tool_by_id_cached
+from app.core.agent_manager import agent_manager
+from app.core.mcp_manager import mcp_manager
 from app.core.auth import manage_auth
+from app.core.cache_control import cache_control
 
 router = APIRouter()
-security = HTTPBearer()
+
+
+async def _evict_tool(tool_id: int, stop_server: bool) -> None:
+    """Drop everything cached for a changed tool so the next request uses its current config."""
+    tool_cache.invalidate(tool_id)
+    # 先停止旧配置启动的服务器，再淘汰 agent，避免停止期间用旧客户端的工具重建
+    if stop_server and mcp_manager.is_running(tool_id):
+        await mcp_manager.stop_mcp_server(tool_id)
+    mcp_manager.invalidate_tool(tool_id)
+    agent_manager.invalidate_tool(tool_id)
 
 
 @router.post("/tools", response_model=MCPToolResponse)
@@ -21,15 +37,13 @@ async def create_mcp_tool(
     current_key: dict = Depends(manage_auth)
 ):
     """Create a new MCP tool."""
+    # 服务器分组表已移除，不再逐个查询分组，直接拒绝
+    if tool_data.group_ids:
+        raise HTTPException(status_code=400, detail="Server groups are not supported")
+    
+    # Create the tool
+    # 重名由唯一约束拒绝，其他错误交给全局异常处理器
     try:
-        # Validate server groups if provided
-        if tool_data.group_ids:
-            for group_id in tool_data.group_ids:
-                group = await ServerGroupQueries.get_group_by_id(group_id)
-                if not group:
-                    raise HTTPException(status_code=404, detail=f"Server group {group_id} not found")
-        
-        # Create the tool
         tool_record = await MCPToolQueries.create_tool(
             name=tool_data.name,
             description=tool_data.description,
@@ -47,17 +61,51 @@ async def create_mcp_tool(
             enabled=tool_data.enabled,
             group_ids=tool_data.group_ids
         )
-        
-        return MCPToolResponse(
-            success=True,
-            message="MCP tool created successfully",
-            data=MCPTool(**tool_record)
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    except asyncpg.UniqueViolationError:
+        raise HTTPException(status_code=400, detail="Tool name already exists")
+    tool_cache.invalidate_enabled()
+    agent_manager.invalidate_universal()
+    
+    return MCPToolResponse(
+        success=True,
+        message="MCP tool created successfully",
+        data=MCPTool(**tool_record)
+    )
+
+
+def _build_server_config(tool: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a tool record to an MCP servers config entry."""
+    # Create server config based on connection type
+    if tool["connection_type"] in ("http", "sse"):
+        # For HTTP/SSE connections, use URL
+        server_config = {"url": tool["url"]}
+    else:
+        # For stdio connections, use command
+        server_config = {"command": tool["command"]}
+    
+    # Only include non-empty fields to keep JSON clean
+    if tool["args"]:
+        server_config["args"] = tool["args"]
+    if tool["env"]:
+        server_config["env"] = tool["env"]
+    if tool["auto_approve"]:
+        server_config["autoApprove"] = tool["auto_approve"]
+    if tool["disabled"] or not tool["enabled"]:
+        server_config["disabled"] = True
+    
+    return server_config
+
+
+async def _stream_tools_config() -> AsyncIterator[bytes]:
+    """Stream the export response body as JSON fragments, one tool at a time."""
+    count = 0
+    yield b'{"success":true,"data":{"mcpServers":{'
+    async for tool in MCPToolQueries.iter_tools_for_export():
+        separator = b"," if count else b""
+        yield separator + orjson.dumps(tool["name"]) + b":" + orjson.dumps(_build_server_config(tool))
+        count += 1
+    # 总数在遍历结束后才知道，因此 message 放在最后输出
+    yield b'}},"message":' + orjson.dumps(f"Exported {count} tools configuration") + b"}"
 
 
 @router.get("/tools/export-config")
@@ -66,65 +114,12 @@ async def export_tools_config(
     current_key: dict = Depends(manage_auth)
 ):
     """Export MCP tools configuration as JSON."""
-    try:
-        if group_id:
-            # Get tools from specific group
-            tools = await MCPToolQueries.get_tools_by_group(group_id)
-            # Also get disabled tools in the group
-            all_tools = await MCPToolQueries.list_all_tools(enabled_only=False)
-            disabled_tools = [tool for tool in all_tools if tool["group_id"] == group_id and not tool["enabled"]]
-            tools.extend(disabled_tools)
-        else:
-            # Get all tools
-            tools = await MCPToolQueries.list_all_tools(enabled_only=False)
-        
-        # Convert to MCP servers format
-        mcp_servers = {}
-        for tool in tools:
-            connection_type = tool["connection_type"]
-            
-            # Create server config based on connection type
-            if connection_type in ["http", "sse"]:
-                # For HTTP/SSE connections, use URL
-                server_config = {
-                    "url": tool["url"],
-                    "args": tool["args"] or [],
-                    "env": tool["env"] or {},
-                    "autoApprove": tool["auto_approve"] or [],
-                    "disabled": tool["disabled"] or not tool["enabled"]
-                }
-            else:
-                # For stdio connections, use command
-                server_config = {
-                    "command": tool["command"],
-                    "args": tool["args"] or [],
-                    "env": tool["env"] or {},
-                    "autoApprove": tool["auto_approve"] or [],
-                    "disabled": tool["disabled"] or not tool["enabled"]
-                }
-            
-            # Remove empty fields to keep JSON clean
-            if not server_config.get("args"):
-                server_config.pop("args", None)
-            if not server_config.get("env"):
-                server_config.pop("env", None)
-            if not server_config.get("autoApprove"):
-                server_config.pop("autoApprove", None)
-            if not server_config.get("disabled"):
-                server_config.pop("disabled", None)
-            
-            mcp_servers[tool["name"]] = server_config
-        
-        return {
-            "success": True,
-            "message": f"Exported {len(tools)} tools configuration",
-            "data": {
-                "mcpServers": mcp_servers
-            }
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    # mcp_tool 表已没有分组列，按分组导出无法在 SQL 中过滤，直接拒绝而不是拉全表
+    if group_id:
+        raise HTTPException(status_code=400, detail="Filtering by server group is not supported")
+    
+    # 边从游标读取边输出，峰值内存与工具总数无关
+    return StreamingResponse(_stream_tools_config(), media_type="application/json")
 
 
 @router.post("/tools/batch-import")
@@ -133,165 +128,182 @@ async def batch_import_tools(
     current_key: dict = Depends(manage_auth)
 ):
     """Batch import MCP tools from JSON configuration."""
-    try:
-        # Validate input structure
-        if "mcpServers" not in import_data:
-            raise HTTPException(status_code=400, detail="Invalid format: 'mcpServers' key not found")
-        
-        mcp_servers = import_data["mcpServers"]
-        group_ids = import_data.get("group_ids", [])  # Optional group IDs
-        
-        # Validate server groups if provided
-        if group_ids:
-            for group_id in group_ids:
-                group = await ServerGroupQueries.get_group_by_id(group_id)
-                if not group:
-                    raise HTTPException(status_code=404, detail=f"Server group {group_id} not found")
-        
-        # Get existing tool names to handle duplicates
-        existing_tools = await MCPToolQueries.list_all_tools(enabled_only=False)
-        existing_names = {tool["name"].lower() for tool in existing_tools}
-        
-        imported_tools = []
-        errors = []
-        
-        for server_name, server_config in mcp_servers.items():
-            try:
-                # Generate unique name if duplicate exists
-                original_name = server_name
-                unique_name = original_name
-                counter = 1
-                
-                while unique_name.lower() in existing_names:
-                    unique_name = f"{original_name}-{counter}"
-                    counter += 1
-                
-                # Add to existing names to prevent duplicates within this batch
-                existing_names.add(unique_name.lower())
-                
-                # Parse server configuration
-                url = server_config.get("url")
-                command = server_config.get("command")
-                args = server_config.get("args", [])
-                env = server_config.get("env", {})
-                auto_approve = server_config.get("autoApprove", [])
-                disabled = server_config.get("disabled", False)
-                
-                # Determine connection type based on configuration
-                connection_type = "stdio"  # Default for most MCP servers
-                
-                # Check if URL is provided (HTTP-based)
-                if url:
-                    if "sse" in str(url).lower() or "sse" in str(args).lower():
-                        connection_type = "sse"
-                    else:
-                        connection_type = "http"
-                    # For HTTP/SSE connections, command should be null
-                    command = None
-                # Check command for HTTP/HTTPS
-                elif command in ["http", "https"]:
-                    connection_type = "http"
-                    # For HTTP connections, command should be null
-                    command = None
-                # Check args for SSE
-                elif "sse" in str(args).lower():
+    # Validate input structure
+    if "mcpServers" not in import_data:
+        raise HTTPException(status_code=400, detail="Invalid format: 'mcpServers' key not found")
+    
+    mcp_servers = import_data["mcpServers"]
+    if not isinstance(mcp_servers, dict):
+        raise HTTPException(status_code=400, detail="Invalid format: 'mcpServers' must be an object")
+    group_ids = import_data.get("group_ids", [])  # Optional group IDs
+    
+    # 服务器分组表已移除，不再逐个查询分组，直接拒绝
+    if group_ids:
+        raise HTTPException(status_code=400, detail="Server groups are not supported")
+    
+    # Get existing tool names to handle duplicates (only those that can clash with this batch)
+    existing_names = await MCPToolQueries.get_existing_names_lower(list(mcp_servers))
+    
+    imported_tools = []
+    errors = []
+    pending = []
+    
+    for server_name, server_config in mcp_servers.items():
+        try:
+            # Generate unique name if duplicate exists
+            original_name = server_name
+            unique_name = original_name
+            lowered = unique_lowered = original_name.lower()
+            counter = 1
+            
+            while unique_lowered in existing_names:
+                unique_name = f"{original_name}-{counter}"
+                unique_lowered = f"{lowered}-{counter}"
+                counter += 1
+            
+            # Add to existing names to prevent duplicates within this batch
+            existing_names.add(unique_lowered)
+            
+            # Parse server configuration
+            url = server_config.get("url")
+            command = server_config.get("command")
+            args = server_config.get("args", [])
+            env = server_config.get("env", {})
+            auto_approve = server_config.get("autoApprove", [])
+            disabled = server_config.get("disabled", False)
+            
+            # Determine connection type based on configuration
+            connection_type = "stdio"  # Default for most MCP servers
+            
+            # 逐个参数查找 "sse"，不再把整个列表转成字符串
+            arg_list = args if isinstance(args, list) else [args]
+            args_has_sse = any(isinstance(arg, str) and "sse" in arg.lower() for arg in arg_list)
+            
+            # Check if URL is provided (HTTP-based)
+            if url:
+                if "sse" in str(url).lower() or args_has_sse:
                     connection_type = "sse"
-                
-                # Create tool
-                tool_record = await MCPToolQueries.create_tool(
-                    name=unique_name,
-                    description=f"Imported from batch: {original_name}",
-                    connection_type=connection_type,
-                    command=command,
-                    args=args,
-                    env=env,
-                    url=url,  # Add URL parameter
-                    headers={},  # Default empty headers
-                    timeout=30,  # Default timeout
-                    retry_count=3,  # Default retry count
-                    retry_delay=5,  # Default retry delay
-                    disabled=disabled,
-                    auto_approve=auto_approve,
-                    enabled=not disabled,
-                    group_ids=group_ids if group_ids else None
-                )
-                
+                else:
+                    connection_type = "http"
+                # For HTTP/SSE connections, command should be null
+                command = None
+            # Check command for HTTP/HTTPS
+            elif command in ["http", "https"]:
+                connection_type = "http"
+                # For HTTP connections, command should be null
+                command = None
+            # Check args for SSE
+            elif args_has_sse:
+                connection_type = "sse"
+            
+            # Queue tool for bulk creation
+            pending.append({
+                "original_name": original_name,
+                "tool": {
+                    "name": unique_name,
+                    "description": f"Imported from batch: {original_name}",
+                    "connection_type": connection_type,
+                    "command": command,
+                    "args": args,
+                    "env": env,
+                    "url": url,
+                    "headers": {},  # Default empty headers
+                    "timeout": 30,  # Default timeout
+                    "retry_count": 3,  # Default retry count
+                    "retry_delay": 5,  # Default retry delay
+                    "disabled": disabled,
+                    "auto_approve": auto_approve,
+                    "enabled": not disabled,
+                }
+            })
+            
+        except Exception as e:
+            errors.append({
+                "tool_name": server_name,
+                "error": str(e)
+            })
+    
+    # Create all tools in one statement (all or nothing)
+    if pending:
+        try:
+            tool_records = await MCPToolQueries.create_tools_bulk(
+                [item["tool"] for item in pending]
+            )
+            tool_cache.invalidate_enabled()
+            agent_manager.invalidate_universal()
+            ids_by_name = {record["name"]: record["id"] for record in tool_records}
+            for item in pending:
+                unique_name = item["tool"]["name"]
                 imported_tools.append({
-                    "original_name": original_name,
+                    "original_name": item["original_name"],
                     "imported_name": unique_name,
-                    "id": tool_record["id"],
-                    "renamed": unique_name != original_name
-                })
-                
-            except Exception as e:
-                errors.append({
-                    "tool_name": server_name,
-                    "error": str(e)
+                    "id": ids_by_name[unique_name],
+                    "renamed": unique_name != item["original_name"]
                 })
-        
-        return {
-            "success": True,
-            "message": f"Batch import completed. {len(imported_tools)} tools imported, {len(errors)} errors",
-            "data": {
-                "imported": imported_tools,
-                "errors": errors,
-                "summary": {
-                    "total_attempted": len(mcp_servers),
-                    "successfully_imported": len(imported_tools),
-                    "errors": len(errors),
-                    "renamed_count": sum(1 for tool in imported_tools if tool["renamed"])
-                }
+        except asyncpg.UniqueViolationError:
+            # 名称在查询已有名称之后被并发占用；其他数据库错误交给全局处理器，不向客户端暴露
+            errors.extend(
+                {"tool_name": item["original_name"], "error": "Tool name already exists"}
+                for item in pending
+            )
+    
+    return {
+        "success": True,
+        "message": f"Batch import completed. {len(imported_tools)} tools imported, {len(errors)} errors",
+        "data": {
+            "imported": imported_tools,
+            "errors": errors,
+            "summary": {
+                "total_attempted": len(mcp_servers),
+                "successfully_imported": len(imported_tools),
+                "errors": len(errors),
+                "renamed_count": sum(1 for tool in imported_tools if tool["renamed"])
             }
         }
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    }
 
 
-@router.get("/tools", response_model=MCPToolListResponse)
+@router.get("/tools", response_model=None)
 async def list_mcp_tools(
     group_id: Optional[int] = Query(None, description="Filter by group ID"),
     enabled_only: bool = Query(True, description="Only return enabled tools"),
-    current_key: dict = Depends(manage_auth)
+    current_key: dict = Depends(manage_auth),
+    cache_headers: dict = Depends(cache_control(0))
 ):
     """List MCP tools."""
-    try:
-        tools = await MCPToolQueries.list_all_tools(enabled_only=enabled_only)
-        
-        return MCPToolListResponse(
-            success=True,
-            message="MCP tools retrieved successfully",
-            data=[MCPTool(**tool) for tool in tools],
-            total=len(tools)
-        )
-        
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    # 与导出接口一致：分组已不存在，不再静默忽略 group_id 返回全部工具
+    if group_id:
+        raise HTTPException(status_code=400, detail="Filtering by server group is not supported")
+    
+    # enabled 过滤和排序都在 SQL 中完成（idx_mcp_tool_enabled）
+    tools = await MCPToolQueries.list_all_tools(enabled_only=enabled_only)
+    
+    # JSON 字段已在查询层解析，直接序列化，不再逐条构造 MCPTool 模型
+    return ORJSONResponse({
+        "success": True,
+        "message": "MCP tools retrieved successfully",
+        "data": tools,
+        "total": len(tools)
+    }, headers=cache_headers)
 
 
-@router.get("/tools/{tool_id}", response_model=MCPToolResponse)
+@router.get("/tools/{tool_id}", response_model=None, responses={200: {"model": MCPToolResponse}})
 async def get_mcp_tool(
     tool_id: int,
-    current_key: dict = Depends(manage_auth)
+    current_key: dict = Depends(manage_auth),
+    cache_headers: dict = Depends(cache_control(0))
 ):
     """Get MCP tool by ID."""
-    try:
-        tool = await MCPToolQueries.get_tool_by_id(tool_id)
-        if not tool:
-            raise HTTPException(status_code=404, detail="MCP tool not found")
-        
-        return MCPToolResponse(
-            success=True,
-            message="MCP tool retrieved successfully",
-            data=MCPTool(**tool)
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    tool = await get_tool_by_id_cached(tool_id)
+    if not tool:
+        raise HTTPException(status_code=404, detail="MCP tool not found")
+    
+    # 自行返回响应以携带缓存头；结构仍写入 OpenAPI 文档
+    return ORJSONResponse(MCPToolResponse(
+        success=True,
+        message="MCP tool retrieved successfully",
+        data=MCPTool(**tool)
+    ).model_dump(mode="json"), headers=cache_headers)
 
 
 @router.put("/tools/{tool_id}", response_model=MCPToolResponse)
@@ -301,14 +313,13 @@ async def update_mcp_tool(
     current_key: dict = Depends(manage_auth)
 ):
     """Update MCP tool."""
+    # 服务器分组表已移除，不再逐个查询分组，直接拒绝
+    if tool_data.group_ids:
+        raise HTTPException(status_code=400, detail="Server groups are not supported")
+    
+    # Update the tool (returns None if the tool does not exist)
+    # 重名由唯一约束拒绝，其他错误交给全局异常处理器
     try:
-        # Check if tool exists
-        existing_tool = await MCPToolQueries.get_tool_by_id(tool_id)
-        if not existing_tool:
-            raise HTTPException(status_code=404, detail="MCP tool not found")
-        
-     
-        # Update the tool
         updated_tool = await MCPToolQueries.update_tool(
             tool_id=tool_id,
             name=tool_data.name,
@@ -327,17 +338,18 @@ async def update_mcp_tool(
             enabled=tool_data.enabled,
             group_ids=tool_data.group_ids
         )
-        
-        return MCPToolResponse(
-            success=True,
-            message="MCP tool updated successfully",
-            data=MCPTool(**updated_tool)
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    except asyncpg.UniqueViolationError:
+        raise HTTPException(status_code=400, detail="Tool name already exists")
+    if not updated_tool:
+        raise HTTPException(status_code=404, detail="MCP tool not found")
+    # 配置可能已变化，停止运行中的服务器，下次使用时按新配置启动
+    await _evict_tool(tool_id, stop_server=True)
+    
+    return MCPToolResponse(
+        success=True,
+        message="MCP tool updated successfully",
+        data=MCPTool(**updated_tool)
+    )
 
 
 @router.delete("/tools/{tool_id}")
@@ -346,26 +358,16 @@ async def delete_mcp_tool(
     current_key: dict = Depends(manage_auth)
 ):
     """Delete MCP tool."""
-    try:
-        # Check if tool exists
-        existing_tool = await MCPToolQueries.get_tool_by_id(tool_id)
-        if not existing_tool:
-            raise HTTPException(status_code=404, detail="MCP tool not found")
-        
-        # Delete the tool
-        success = await MCPToolQueries.delete_tool(tool_id)
-        if not success:
-            raise HTTPException(status_code=400, detail="Failed to delete MCP tool")
-        
-        return {
-            "success": True,
-            "message": "MCP tool deleted successfully"
-        }
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    # Delete the tool (no row deleted means the tool does not exist)
+    success = await MCPToolQueries.delete_tool(tool_id)
+    await _evict_tool(tool_id, stop_server=True)
+    if not success:
+        raise HTTPException(status_code=404, detail="MCP tool not found")
+    
+    return {
+        "success": True,
+        "message": "MCP tool deleted successfully"
+    }
 
 
 @router.put("/tools/{tool_id}/status")
@@ -375,25 +377,18 @@ async def update_tool_status(
     current_key: dict = Depends(manage_auth)
 ):
     """Update tool status (enable/disable)."""
-    try:
-        # Check if tool exists
-        existing_tool = await MCPToolQueries.get_tool_by_id(tool_id)
-        if not existing_tool:
-            raise HTTPException(status_code=404, detail="MCP tool not found")
-        
-        enabled = status_data.get("enabled")
-        if enabled is None:
-            raise HTTPException(status_code=400, detail="'enabled' field is required")
-        
-        # Update tool status
-        await MCPToolQueries.update_tool_status(tool_id, enabled)
-        
-        return {
-            "success": True,
-            "message": f"Tool {'enabled' if enabled else 'disabled'} successfully"
-        }
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    enabled = status_data.get("enabled")
+    if enabled is None:
+        raise HTTPException(status_code=400, detail="'enabled' field is required")
+    
+    # Update tool status (no row updated means the tool does not exist)
+    success = await MCPToolQueries.update_tool_status(tool_id, enabled)
+    # 禁用时停止运行中的服务器
+    await _evict_tool(tool_id, stop_server=not enabled)
+    if not success:
+        raise HTTPException(status_code=404, detail="MCP tool not found")
+    
+    return {
+        "success": True,
+        "message": f"Tool {'enabled' if enabled else 'disabled'} successfully"
+    }
@@ -3,21 +3,25 @@ OpenAI compatible API endpoints.
 """
 import logging
 import time
-import json
-import uuid
+import secrets
 import asyncio
-from typing import List, Optional, Dict, Any, AsyncGenerator
+import functools
+import orjson
+from typing import List, Optional, Dict, Any, AsyncGenerator, AsyncIterator, Callable
 from fastapi import APIRouter, HTTPException, Depends, Request, Response, Header, Cookie
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from strands import Agent
 
+from app.config import settings
 from app.core.auth import api_key_auth
-from app.db.assistant_queries import AssistantQueries
-from app.db.queries import MCPToolQueries
+from app.db.assistant_queries import AssistantToolQueries
 from app.core.mcp_manager import mcp_manager
+from app.core.tool_cache import get_enabled_tool_ids_cached
 from app.core.agent_manager import agent_manager
-from app.db.api_key_queries import APIKeyAssistantQueries
+from app.core.assistant_cache import assistant_name_cache
+from app.core.apikey_cache import get_allowed_assistant_ids_cached
+from app.core.usage_log_buffer import usage_log_buffer
 
 logger = logging.getLogger(__name__)
 
@@ -66,22 +70,20 @@ class ChatCompletionResponse(BaseModel):
     session_id: Optional[str] = None  # Session ID for continuing the conversation
 
 
-class DeltaMessage(BaseModel):
-    """Delta message for streaming."""
-    role: Optional[str] = None
-    content: Optional[str] = None
+# 流式块格式：{"id", "object": "chat.completion.chunk", "created", "model",
+#              "choices": [{"index": 0, "delta": {...}, "finish_reason": ...}]}
+# 以下是其中与请求无关的固定结尾，进程内只构造一次
+ROLE_CHUNK_TAIL = b'{"role":"assistant"},"finish_reason":null}]}\n\n'
+CONTENT_CHUNK_TAIL = b'},"finish_reason":null}]}\n\n'
+# 中间内容块只携带 delta，完整字段只出现在首块和末块
+COMPACT_CONTENT_PREFIX = b'data: {"choices":[{"index":0,"delta":{"content":'
+COMPACT_CONTENT_TAIL = b'}}]}\n\n'
+STOP_CHUNK_TAIL = b'{},"finish_reason":"stop"}]}\n\n'
+DONE_EVENT = b"data: [DONE]\n\n"
 
 
-class ChatCompletionChunk(BaseModel):
-    """Chat completion chunk for streaming."""
-    id: str
-    object: str = "chat.completion.chunk"
-    created: int
-    model: str
-    choices: List[Dict[str, Any]]
-
-
-@router.post("/chat/completions", response_model=ChatCompletionResponse)
+# 直接返回 ORJSONResponse，跳过 response_model 的二次校验；响应结构仍写入 OpenAPI 文档
+@router.post("/chat/completions", response_model=None, responses={200: {"model": ChatCompletionResponse}})
 async def create_chat_completion(
     request: ChatCompletionRequest,
     req: Request,
@@ -89,17 +91,26 @@ async def create_chat_completion(
     x_session_id: Optional[str] = Header(None)
 ):
     """Create a chat completion."""
+    # 调用日志在结果确定后记录（异步批量写入，不阻塞请求），状态码和错误信息与实际结果一致
+    log_usage = functools.partial(
+        usage_log_buffer.add,
+        api_key_id=current_key["id"],
+        endpoint=req.url.path,
+        ip_address=req.client.host if req.client else None,
+        user_agent=req.headers.get("user-agent"),
+        request_size=int(req.headers.get("content-length", 0)) or None,
+    )
+    assistant_id = None
     try:
-        # Check if the user has access to the requested assistant
+        # 助手查找和 Key 的授权列表互不依赖，并发获取后在本地判断权限
         assistant_name = request.model
-        assistant = await get_assistant_by_name(assistant_name)
-        
-        # Check if the API key has access to this assistant
-        has_access = await APIKeyAssistantQueries.check_key_assistant_access(
-            current_key["id"], assistant["id"]
+        assistant, allowed_ids = await asyncio.gather(
+            get_assistant_by_name(assistant_name),
+            get_allowed_assistant_ids_cached(current_key["id"]),
         )
+        assistant_id = assistant["id"]
         
-        if not has_access:
+        if assistant["id"] not in allowed_ids:
             raise HTTPException(
                 status_code=403, 
                 detail=f"API key does not have access to assistant: {assistant_name}"
@@ -126,146 +137,137 @@ async def create_chat_completion(
             )
         
         # Add user messages to session
-        for message in request.messages:
-            if message.role == "user":
-                agent_manager.add_message_to_session(session_id, "user", message.content)
+        agent_manager.add_messages_to_session(
+            session_id,
+            [("user", message.content) for message in request.messages if message.role == "user"]
+        )
         
-        # 处理请求
+        # 处理请求；流式响应在生成器结束时记录日志
         if request.stream:
-            return await stream_chat_completion(request, assistant, agent, session_id)
-        else:
-            return await regular_chat_completion(request, assistant, agent, session_id)
+            return await stream_chat_completion(
+                request, assistant, agent, session_id,
+                functools.partial(log_usage, assistant_id=assistant_id)
+            )
+        response = await regular_chat_completion(request, assistant, agent, session_id)
+        log_usage(status_code=200, assistant_id=assistant_id, response_size=len(response.body))
+        return response
         
-    except HTTPException:
+    except HTTPException as e:
+        log_usage(status_code=e.status_code, assistant_id=assistant_id, error_message=str(e.detail))
         raise
     except Exception as e:
         logger.error(f"Error in create_chat_completion: {e}", exc_info=True)
+        log_usage(status_code=500, assistant_id=assistant_id, error_message=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 
 async def get_tool_ids_for_assistant(assistant: Dict[str, Any]) -> List[int]:
     """获取助手的工具 ID 列表。"""
-    assistant_id = assistant["id"]
-    
     if assistant["type"] == "dedicated":
-        # For dedicated assistants, get the associated tools
-        assistant_with_tools = await AssistantQueries.get_assistant_with_tools(assistant_id)
-        # Ensure tools is a list
-        if not isinstance(assistant_with_tools["tools"], list):
-            import json
-            if isinstance(assistant_with_tools["tools"], str):
-                try:
-                    assistant_with_tools["tools"] = json.loads(assistant_with_tools["tools"])
-                except json.JSONDecodeError:
-                    assistant_with_tools["tools"] = []
-            else:
-                assistant_with_tools["tools"] = []
-        
-        # Get tool IDs sorted by priority
-        tool_ids = [
-            tool["id"] for tool in sorted(
-                assistant_with_tools["tools"], 
-                key=lambda x: x.get("priority", 999)
-            )
-        ]
-        
-    else:  # Universal assistant
-        # For universal assistants, we'll use all available tools
-        # In a real implementation, you'd use vector search to find relevant tools
-        # based on the query, but for simplicity we'll use all enabled tools
-        tools_data = await MCPToolQueries.list_enabled_tools()
-        tool_ids = [tool["id"] for tool in tools_data]
-        
-        # Limit to max_tools if specified
-        max_tools = assistant.get("max_tools", 5)
-        if len(tool_ids) > max_tools:
-            tool_ids = tool_ids[:max_tools]
+        # For dedicated assistants, get the associated tool IDs (sorted by priority in SQL)
+        return await AssistantToolQueries.get_assistant_tool_ids(assistant["id"])
+    
+    # For universal assistants, we'll use all available tools
+    # In a real implementation, you'd use vector search to find relevant tools
+    # based on the query, but for simplicity we'll use all enabled tools
+    tool_ids = await get_enabled_tool_ids_cached()
     
-    return tool_ids
+    # Limit to max_tools if specified
+    max_tools = assistant.get("max_tools", 5)
+    return list(tool_ids[:max_tools])
 
 
 async def stream_chat_completion(
     request: ChatCompletionRequest,
     assistant: Dict[str, Any],
     agent: Agent,
-    session_id: str
+    session_id: str,
+    log_usage: Callable[..., None]
 ) -> StreamingResponse:
-    """Stream chat completion."""
-    async def generate() -> AsyncGenerator[str, None]:
+    """Stream chat completion.
+    
+    ``log_usage`` is called once the stream ends with its status code,
+    response size and error message.
+    """
+    # 日志使用 %s 参数，级别关闭时不做字符串格式化；逐 token 的循环内不记录日志
+    assistant_id = assistant["id"]
+    
+    async def generate() -> AsyncGenerator[bytes, None]:
+        # 响应头已经发出，结果只能在流结束时确定；客户端中途断开记为 499
+        status_code, error_message, response_size = 499, "Client disconnected", 0
         try:
-            logger.info(f"Starting stream chat completion for assistant {assistant['id']}")
+            logger.info("Starting stream chat completion for assistant %s", assistant_id)
             
             # Prepare the prompt from messages
             prompt = prepare_prompt_from_messages(request.messages)
-            logger.info(f"Prepared prompt for assistant {assistant['id']}")
+            logger.debug("Prepared prompt for assistant %s", assistant_id)
             
             # Stream the response
-            chunk_id = f"chatcmpl-{uuid.uuid4()}"
+            chunk_id = f"chatcmpl-{secrets.token_hex(12)}"
             created = int(time.time())
             
-            # Send the first chunk with role
-            first_chunk = ChatCompletionChunk(
-                id=chunk_id,
-                created=created,
-                model=request.model,
-                choices=[{
-                    "index": 0,
-                    "delta": {"role": "assistant"},
-                    "finish_reason": None
-                }]
+            # 除 delta 和 finish_reason 外，每个块的字段在整个请求中不变，预先序列化公共前缀
+            chunk_prefix = (
+                b'data: {"id":' + orjson.dumps(chunk_id)
+                + b',"object":"chat.completion.chunk","created":' + str(created).encode()
+                + b',"model":' + orjson.dumps(request.model)
+                + b',"choices":[{"index":0,"delta":'
             )
-            yield f"data: {json.dumps(first_chunk.model_dump())}\n\n"
+            if settings.stream_compact_chunks:
+                content_prefix, content_tail = COMPACT_CONTENT_PREFIX, COMPACT_CONTENT_TAIL
+            else:
+                content_prefix, content_tail = chunk_prefix + b'{"content":', CONTENT_CHUNK_TAIL
+            
+            # Send the first chunk with role
+            event = chunk_prefix + ROLE_CHUNK_TAIL
+            response_size += len(event)
+            yield event
             
             # Stream the content
-            logger.info(f"Starting stream_async for assistant {assistant['id']}")
-            full_response = ""
+            logger.debug("Starting stream_async for assistant %s", assistant_id)
+            # 回复片段先收集到列表，结束时一次拼接
+            response_parts: List[str] = []
             
-            async for event in agent.stream_async(prompt):
-                if "data" in event and event["data"]:
-                    chunk = ChatCompletionChunk(
-                        id=chunk_id,
-                        created=created,
-                        model=request.model,
-                        choices=[{
-                            "index": 0,
-                            "delta": {"content": event["data"]},
-                            "finish_reason": None
-                        }]
-                    )
-                    yield f"data: {json.dumps(chunk.model_dump())}\n\n"
-                    full_response += event["data"]
+            # 缓存的 Agent 由多个请求共享，同一时间只能处理一个请求
+            async with mcp_manager.agent_lock(agent):
+                async for text in coalesce_stream_text(agent.stream_async(prompt)):
+                    # 一次 join 生成事件，不产生中间 bytes 对象
+                    event = b"".join((content_prefix, orjson.dumps(text), content_tail))
+                    response_size += len(event)
+                    yield event
+                    response_parts.append(text)
             
             # Add assistant response to session
-            agent_manager.add_message_to_session(session_id, "assistant", full_response)
+            agent_manager.add_message_to_session(session_id, "assistant", "".join(response_parts))
             
             # Send the final chunk
-            final_chunk = ChatCompletionChunk(
-                id=chunk_id,
-                created=created,
-                model=request.model,
-                choices=[{
-                    "index": 0,
-                    "delta": {},
-                    "finish_reason": "stop"
-                }]
-            )
-            yield f"data: {json.dumps(final_chunk.model_dump())}\n\n"
-            yield "data: [DONE]\n\n"
-            logger.info(f"Completed stream chat completion for assistant {assistant['id']}")
+            event = chunk_prefix + STOP_CHUNK_TAIL
+            status_code, error_message = 200, None
+            response_size += len(event) + len(DONE_EVENT)
+            yield event
+            yield DONE_EVENT
+            logger.info("Completed stream chat completion for assistant %s", assistant_id)
             
         except Exception as e:
             logger.error(f"Error in stream_chat_completion: {e}", exc_info=True)
+            status_code, error_message = 500, str(e)
             error_chunk = {
                 "error": {
                     "message": str(e),
                     "type": "internal_error"
                 }
             }
-            yield f"data: {json.dumps(error_chunk)}\n\n"
+            event = b"data: " + orjson.dumps(error_chunk) + b"\n\n"
+            response_size += len(event)
+            yield event
+        finally:
+            log_usage(status_code=status_code, response_size=response_size, error_message=error_message)
     
     return StreamingResponse(
         generate(),
-        media_type="text/event-stream"
+        media_type="text/event-stream",
+        # 禁止中间代理（如 nginx）缓冲，保证每个事件到达后立即发送给客户端
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
 
@@ -274,35 +276,38 @@ async def regular_chat_completion(
     assistant: Dict[str, Any],
     agent: Agent,
     session_id: str
-) -> ChatCompletionResponse:
+) -> ORJSONResponse:
     """Regular chat completion."""
     try:
         # Prepare the prompt from messages
         prompt = prepare_prompt_from_messages(request.messages)
         
         # Get the response using direct agent invocation
-        response = agent(prompt)
+        # 同步调用会阻塞到模型返回，放到线程池执行以免阻塞事件循环；
+        # 缓存的 Agent 由多个请求共享，加锁保证同一时间只有一个线程在修改其 messages
+        async with mcp_manager.agent_lock(agent):
+            response = await asyncio.to_thread(agent, prompt)
+        
+        # 只提取一次文本，会话和响应共用
+        content = extract_response_text(response)
         
         # Add assistant response to session
-        agent_manager.add_message_to_session(session_id, "assistant", str(response))
+        agent_manager.add_message_to_session(session_id, "assistant", content)
         
-        return ChatCompletionResponse(
-            id=f"chatcmpl-{uuid.uuid4()}",
-            created=int(time.time()),
-            model=request.model,
-            choices=[
-                ChatCompletionChoice(
-                    index=0,
-                    message=Message(
-                        role="assistant",
-                        content=str(response)
-                    ),
-                    finish_reason="stop"
-                )
-            ],
-            usage=ChatCompletionUsage(),
-            session_id=session_id
-        )
+        # 字段与 ChatCompletionResponse 一致，直接构造字典由 orjson 序列化
+        return ORJSONResponse({
+            "id": f"chatcmpl-{secrets.token_hex(12)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            "session_id": session_id
+        })
         
     except Exception as e:
         logger.error(f"Error in regular_chat_completion: {e}", exc_info=True)
@@ -310,40 +315,113 @@ async def regular_chat_completion(
 
 
 async def get_assistant_by_name(name: str) -> Dict[str, Any]:
-    """Get assistant by name."""
-    # First try exact match
-    assistants = await AssistantQueries.list_assistants(enabled_only=True)
-    for assistant in assistants:
-        if assistant["name"] == name:
-            return assistant
+    """Get assistant by name (exact match first, then case-insensitive)."""
+    assistant = await assistant_name_cache.get(name)
+    if not assistant:
+        raise HTTPException(status_code=404, detail=f"Assistant not found: {name}")
+    return assistant
+
+
+async def coalesce_stream_text(events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    """Merge streamed text deltas into larger pieces.
     
-    # Then try case-insensitive match
-    for assistant in assistants:
-        if assistant["name"].lower() == name.lower():
-            return assistant
+    A piece is emitted once it reaches ``stream_flush_chars`` characters or
+    ``stream_flush_interval`` seconds after its first delta, whichever comes first.
+    """
+    max_chars = settings.stream_flush_chars
+    interval = settings.stream_flush_interval
+    loop = asyncio.get_running_loop()
+    iterator = events.__aiter__()
+    buffer: List[str] = []
+    buffered = 0
+    deadline = 0.0
+    pending: Optional[asyncio.Future] = None
     
-    raise HTTPException(status_code=404, detail=f"Assistant not found: {name}")
+    try:
+        while True:
+            if pending is None:
+                # 不能对 __anext__ 使用 wait_for：超时取消会关闭底层生成器
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(deadline - loop.time(), 0) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            
+            if not done:
+                # 时间窗口到期，发送已缓冲的内容，继续等待同一个 pending
+                yield "".join(buffer)
+                buffer.clear()
+                buffered = 0
+                continue
+            
+            try:
+                event = pending.result()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                # 出错前已收到的内容仍然发送出去
+                if buffer:
+                    yield "".join(buffer)
+                raise
+            finally:
+                pending = None
+            
+            text = event.get("data") if isinstance(event, dict) else None
+            if not text:
+                continue
+            if max_chars <= 0:
+                yield text
+                continue
+            
+            if not buffer:
+                deadline = loop.time() + interval
+            buffer.append(text)
+            buffered += len(text)
+            if buffered >= max_chars:
+                yield "".join(buffer)
+                buffer.clear()
+                buffered = 0
+        
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+# 各角色在提示词中的前缀，其他角色的消息会被忽略
+ROLE_PREFIXES = {
+    "system": "System: ",
+    "user": "User: ",
+    "assistant": "Assistant: ",
+}
 
 
 def prepare_prompt_from_messages(messages: List[Message]) -> str:
     """Prepare a prompt from a list of messages."""
-    prompt = ""
-    
+    parts = []
     for message in messages:
-        role = message.role.lower()
-        content = message.content
-        
-        if role == "system":
-            prompt += f"System: {content}\n\n"
-        elif role == "user":
-            prompt += f"User: {content}\n\n"
-        elif role == "assistant":
-            prompt += f"Assistant: {content}\n\n"
+        prefix = ROLE_PREFIXES.get(message.role.lower())
+        if prefix:
+            # 分段追加，由最后的 join 一次性拼接，不再逐条格式化
+            parts += (prefix, message.content, "\n\n")
     
     # Add a final assistant prefix to indicate it's the assistant's turn
-    prompt += "Assistant: "
+    parts.append("Assistant: ")
     
-    return prompt
+    return "".join(parts)
+
+
+def extract_response_text(response: Any) -> str:
+    """Extract the text of an agent result's final message."""
+    message = getattr(response, "message", None)
+    if not isinstance(message, dict):
+        return str(response)
+    
+    # 与 AgentResult.__str__ 输出一致（每段文本后带换行），但用一次 join 代替逐段拼接
+    return "".join(
+        item["text"] + "\n"
+        for item in message.get("content", [])
+        if isinstance(item, dict) and "text" in item
+    )
 
 
 async def refresh_assistant_agent(assistant_id: int) -> bool:
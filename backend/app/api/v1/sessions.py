@@ -2,13 +2,15 @@
 Session management API endpoints.
 """
 import logging
-from typing import List, Dict, Any, Optional
+from typing import Dict, Any, Optional
 from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import ORJSONResponse
 
 from app.core.auth import api_key_auth
 from app.core.agent_manager import agent_manager
 from app.db.assistant_queries import AssistantQueries
-from app.db.api_key_queries import APIKeyAssistantQueries
+from app.core.apikey_cache import check_key_assistant_access_cached, get_allowed_assistant_ids_cached
+from app.utils.datetime_utils import format_timestamp
 
 logger = logging.getLogger(__name__)
 
@@ -36,7 +38,7 @@ async def create_session(
             raise HTTPException(status_code=404, detail=f"Assistant {assistant_id} not found")
         
         # Check if API key has access to this assistant
-        has_access = await APIKeyAssistantQueries.check_key_assistant_access(
+        has_access = await check_key_assistant_access_cached(
             current_key["id"], assistant_id
         )
         
@@ -83,7 +85,7 @@ async def get_session(
     
     # Check if API key has access to this assistant
     assistant_id = session["assistant_id"]
-    has_access = await APIKeyAssistantQueries.check_key_assistant_access(
+    has_access = await check_key_assistant_access_cached(
         current_key["id"], assistant_id
     )
     
@@ -98,12 +100,12 @@ async def get_session(
         "assistant_id": assistant_id,
         "assistant_name": assistant["name"] if assistant else "Unknown",
         "created_at": session["created_at"],
-        "last_used": session["last_used"],
+        "last_used": format_timestamp(session["last_used"]),
         "message_count": len(session["messages"])
     }
 
 
-@router.get("/sessions/{session_id}/messages", response_model=List[Dict[str, Any]])
+@router.get("/sessions/{session_id}/messages", response_model=None)
 async def get_session_messages(
     session_id: str,
     current_key: dict = Depends(api_key_auth)
@@ -123,14 +125,15 @@ async def get_session_messages(
     
     # Check if API key has access to this assistant
     assistant_id = session["assistant_id"]
-    has_access = await APIKeyAssistantQueries.check_key_assistant_access(
+    has_access = await check_key_assistant_access_cached(
         current_key["id"], assistant_id
     )
     
     if not has_access:
         raise HTTPException(status_code=403, detail="API key does not have access to this session")
     
-    return session["messages"]
+    # 消息列表随对话增长，直接序列化，不再逐条经过 response_model 校验
+    return ORJSONResponse(session["messages"])
 
 
 @router.post("/sessions/{session_id}/messages", response_model=Dict[str, Any])
@@ -157,7 +160,7 @@ async def add_message_to_session(
     
     # Check if API key has access to this assistant
     assistant_id = session["assistant_id"]
-    has_access = await APIKeyAssistantQueries.check_key_assistant_access(
+    has_access = await check_key_assistant_access_cached(
         current_key["id"], assistant_id
     )
     
@@ -176,7 +179,7 @@ async def add_message_to_session(
     return {"success": True, "message": "Message added to session"}
 
 
-@router.get("/sessions", response_model=List[Dict[str, Any]])
+@router.get("/sessions", response_model=None)
 async def list_sessions(
     current_key: dict = Depends(api_key_auth),
     assistant_id: Optional[int] = Query(None, description="Filter by assistant ID")
@@ -194,30 +197,31 @@ async def list_sessions(
     # with proper database storage for sessions in a production environment
     
     # For now, we'll just return sessions from memory that match the user_id
-    sessions = []
-    
-    for session_id, session in agent_manager._session_data.items():
-        if session.get("user_id") == current_key["id"]:
-            # If assistant_id filter is provided, check it
-            if assistant_id is not None and session.get("assistant_id") != assistant_id:
-                continue
-                
-            # Check if API key has access to this assistant
-            has_access = await APIKeyAssistantQueries.check_key_assistant_access(
-                current_key["id"], session["assistant_id"]
-            )
-            
-            if has_access:
-                # Get assistant info
-                assistant = await AssistantQueries.get_assistant_by_id(session["assistant_id"])
-                
-                sessions.append({
-                    "session_id": session_id,
-                    "assistant_id": session["assistant_id"],
-                    "assistant_name": assistant["name"] if assistant else "Unknown",
-                    "created_at": session["created_at"],
-                    "last_used": session["last_used"],
-                    "message_count": len(session["messages"])
-                })
-    
-    return sessions
+    user_sessions = [
+        (session_id, session)
+        for session_id, session in agent_manager.list_user_sessions(current_key["id"])
+        # If assistant_id filter is provided, check it
+        if assistant_id is None or session.get("assistant_id") == assistant_id
+    ]
+    if not user_sessions:
+        return ORJSONResponse([])
+    
+    # 权限来自缓存的授权列表，助手信息一次批量查询
+    allowed_ids = await get_allowed_assistant_ids_cached(current_key["id"])
+    assistant_ids = {session["assistant_id"] for _, session in user_sessions} & allowed_ids
+    assistants = await AssistantQueries.get_assistants_by_ids(list(assistant_ids)) if assistant_ids else []
+    names = {assistant["id"]: assistant["name"] for assistant in assistants}
+    
+    # 会话数据已全部在内存中，直接由 orjson 序列化，不再逐条经过 response_model 校验
+    return ORJSONResponse([
+        {
+            "session_id": session_id,
+            "assistant_id": session["assistant_id"],
+            "assistant_name": names.get(session["assistant_id"], "Unknown"),
+            "created_at": session["created_at"],
+            "last_used": format_timestamp(session["last_used"]),
+            "message_count": len(session["messages"])
+        }
+        for session_id, session in user_sessions
+        if session["assistant_id"] in allowed_ids
+    ])
@@ -17,6 +17,8 @@ class Settings(BaseSettings):
     app_port: int = 8000
     app_debug: bool = False
     app_log_level: str = "INFO"
+    # 事件循环实现：auto 在安装了 uvloop（uvicorn[standard] 自带）时使用 uvloop，否则使用 asyncio
+    app_loop: str = "auto"
     
     # 数据库配置
     database_url: Optional[str] = None
@@ -25,6 +27,15 @@ class Settings(BaseSettings):
     database_name: str = "mcp_connector"
     database_user: str = "postgres"
     database_password: str = ""
+    # 连接池配置：create_pool 启动时会预先建立 min_size 个连接
+    database_pool_min_size: int = 4
+    database_pool_max_size: int = 10
+    database_connect_timeout: float = 10
+    database_command_timeout: float = 60
+    # 等待空闲连接的最长时间，连接池耗尽时快速失败而不是无限排队
+    database_pool_acquire_timeout: float = 10
+    # 每个连接缓存的预编译语句数量；使用 transaction 模式的 pgbouncer 时需设为 0
+    database_statement_cache_size: int = 1024
     
     # Strands Model Provider 配置
     model_provider: str = "openai"
@@ -60,7 +71,30 @@ class Settings(BaseSettings):
     # 助手配置
     max_recalled_tools: int = 5
     intent_extraction_model: str = "gpt-4o-mini"
-    
+    # 流式输出合并：累计到 stream_flush_chars 个字符或等待 stream_flush_interval 秒后发送一个事件，0 表示逐 token 发送
+    stream_flush_chars: int = 64
+    stream_flush_interval: float = 0.02
+    # 中间内容块省略 id/object/created/model/finish_reason，只发送 delta；客户端要求完整字段时关闭
+    stream_compact_chunks: bool = True
+
+    # 缓存配置
+    api_key_cache_size: int = 4096
+    api_key_cache_ttl: int = 60
+    # 同一个 Key 最多每隔 api_key_last_used_interval 秒更新一次 last_used_at
+    api_key_last_used_interval: int = 30
+    tool_cache_size: int = 1024
+    tool_cache_ttl: int = 30
+    health_cache_ttl: int = 2
+    health_schema_cache_ttl: int = 60
+    # Agent 实例缓存：超过 agent_idle_ttl 秒未使用或超出容量（LRU）时淘汰
+    agent_cache_size: int = 256
+    agent_idle_ttl: int = 1800
+    assistant_cache_size: int = 1024
+    assistant_cache_ttl: int = 30
+    # 会话：超过 session_idle_ttl 秒未使用或超出容量（LRU）时淘汰
+    session_cache_size: int = 10000
+    session_idle_ttl: int = 3600
+
     @field_validator("database_url", mode="before")
     @classmethod
     def build_database_url(cls, v: Optional[str], info) -> str:
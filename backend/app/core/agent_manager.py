@@ -4,27 +4,75 @@ Agent Manager for persistent agent instances.
 import logging
 import asyncio
 import time
-from typing import Dict, List, Optional, Any, Tuple
-from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Set, Tuple
+from datetime import datetime
 
+from cachetools import Cache, TTLCache
 from strands import Agent
 
+from app.config import settings
 from app.db.assistant_queries import AssistantQueries
 from app.core.mcp_manager import mcp_manager
+from app.core.tool_cache import get_enabled_tool_ids_cached
+from app.utils.datetime_utils import format_timestamp
 
 logger = logging.getLogger(__name__)
 
 
+class _SessionCache(TTLCache):
+    """TTLCache of sessions that keeps a user_id -> session IDs index in sync."""
+    
+    def __init__(self, maxsize: int, ttl: float, timer=time.monotonic):
+        super().__init__(maxsize=maxsize, ttl=ttl, timer=timer)
+        self.by_user: Dict[Any, Set[str]] = {}  # user_id -> session IDs
+    
+    def __setitem__(self, session_id: str, session: Dict[str, Any]) -> None:
+        super().__setitem__(session_id, session)
+        self.by_user.setdefault(session.get("user_id"), set()).add(session_id)
+    
+    def __delitem__(self, session_id: str) -> None:
+        # 覆盖 popitem（超出容量时淘汰）的删除路径；过期会话在 expire 中处理
+        session = Cache.__getitem__(self, session_id)
+        try:
+            super().__delitem__(session_id)
+        finally:
+            self._unindex(session_id, session)
+    
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for session_id, session in expired:
+            self._unindex(session_id, session)
+        return expired
+    
+    def clear(self) -> None:
+        super().clear()
+        self.by_user.clear()
+    
+    def _unindex(self, session_id: str, session: Dict[str, Any]) -> None:
+        user_id = session.get("user_id")
+        session_ids = self.by_user.get(user_id)
+        if session_ids is not None:
+            session_ids.discard(session_id)
+            if not session_ids:
+                del self.by_user[user_id]
+
+
 class AgentManager:
     """Manager for persistent agent instances."""
     
     def __init__(self):
-        self._agents: Dict[int, Agent] = {}  # assistant_id -> Agent
-        self._agent_info: Dict[int, Dict[str, Any]] = {}  # assistant_id -> agent info
-        self._lock = asyncio.Lock()
-        self._last_used: Dict[int, datetime] = {}  # assistant_id -> last used timestamp
-        self._session_data: Dict[str, Dict[str, Any]] = {}  # session_id -> session data
-        self._max_idle_time = timedelta(minutes=30)  # Maximum idle time before agent cleanup
+        # assistant_id -> (Agent, agent info)；容量有上限，每次使用时重新写入以刷新空闲 TTL
+        self._agents: TTLCache = TTLCache(
+            maxsize=settings.agent_cache_size,
+            ttl=settings.agent_idle_ttl,
+        )
+        # assistant_id -> 构建锁；同一助手的并发首次请求只构建一次，不同助手互不阻塞
+        self._build_locks: Dict[int, asyncio.Lock] = {}
+        # session_id -> session data；按最后使用时间过期，写入时顺带淘汰到期会话，无需定时扫描
+        self._session_data = _SessionCache(
+            maxsize=settings.session_cache_size,
+            ttl=settings.session_idle_ttl,
+        )
         logger.info("Agent Manager initialized")
     
     async def get_agent_for_assistant(self, assistant_id: int, force_refresh: bool = False) -> Optional[Agent]:
@@ -38,12 +86,18 @@ class AgentManager:
         Returns:
             Agent instance or None if failed
         """
-        async with self._lock:
-            # Check if we already have an agent for this assistant and it's not forced to refresh
-            if not force_refresh and assistant_id in self._agents:
-                # Update last used time
-                self._last_used[assistant_id] = datetime.utcnow()
-                return self._agents[assistant_id]
+        # 命中缓存时无需加锁；重新写入以刷新空闲 TTL
+        entry = None if force_refresh else self._agents.get(assistant_id)
+        if entry is not None:
+            self._agents[assistant_id] = entry
+            return entry[0]
+        
+        lock = self._build_locks.setdefault(assistant_id, asyncio.Lock())
+        async with lock:
+            # 等锁期间可能已被其他请求构建
+            entry = None if force_refresh else self._agents.get(assistant_id)
+            if entry is not None:
+                return entry[0]
             
             # Get assistant from database
             assistant = await AssistantQueries.get_assistant_with_tools(assistant_id)
@@ -61,19 +115,51 @@ class AgentManager:
                 return None
             
             # Store agent and info
-            self._agents[assistant_id] = agent
-            self._agent_info[assistant_id] = {
+            self._agents[assistant_id] = (agent, {
                 "assistant_id": assistant_id,
                 "name": assistant["name"],
                 "type": assistant["type"],
                 "tool_ids": tool_ids,
                 "created_at": datetime.utcnow().isoformat(),
-            }
-            self._last_used[assistant_id] = datetime.utcnow()
+            })
             
             logger.info(f"Created agent for assistant {assistant_id}: {assistant['name']}")
             return agent
     
+    def invalidate_tool(self, tool_id: int) -> int:
+        """
+        Drop cached agents that may depend on a tool.
+        
+        Args:
+            tool_id: The updated, deleted, enabled or disabled tool ID
+            
+        Returns:
+            int: Number of agents dropped
+        """
+        # 通用助手使用全部启用的工具，工具启停都会影响其工具集合，一并淘汰
+        return self._drop_agents(
+            lambda info: info["type"] != "dedicated" or tool_id in info["tool_ids"]
+        )
+    
+    def invalidate_universal(self) -> int:
+        """
+        Drop cached agents of universal assistants, e.g. after tools are created.
+        
+        Returns:
+            int: Number of agents dropped
+        """
+        return self._drop_agents(lambda info: info["type"] != "dedicated")
+    
+    def _drop_agents(self, predicate) -> int:
+        """Drop cached agents whose info matches the predicate."""
+        # 缓存容量有上限，只在工具变更时调用，遍历的开销可以接受；下次请求时按最新配置重建
+        stale = [assistant_id for assistant_id, (_, info) in list(self._agents.items()) if predicate(info)]
+        for assistant_id in stale:
+            self._agents.pop(assistant_id, None)
+        if stale:
+            logger.info("Dropped %s cached agents after tool changes", len(stale))
+        return len(stale)
+    
     async def refresh_agent(self, assistant_id: int) -> bool:
         """
         Refresh an agent for an assistant.
@@ -105,11 +191,13 @@ class AgentManager:
         import uuid
         session_id = str(uuid.uuid4())
         
+        now = time.time()
+        # last_used 每次访问都会更新，保存为时间戳，只在返回给客户端时格式化
         self._session_data[session_id] = {
             "assistant_id": assistant_id,
             "user_id": user_id,
-            "created_at": datetime.utcnow().isoformat(),
-            "last_used": datetime.utcnow().isoformat(),
+            "created_at": format_timestamp(now),
+            "last_used": now,
             "messages": [],
             "metadata": {}
         }
@@ -128,10 +216,30 @@ class AgentManager:
         """
         session = self._session_data.get(session_id)
         if session:
-            # Update last used time
-            session["last_used"] = datetime.utcnow().isoformat()
+            # Update last used time and re-insert to reset the idle TTL
+            session["last_used"] = time.time()
+            self._session_data[session_id] = session
         return session
     
+    def list_user_sessions(self, user_id: Any) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Get a snapshot of the live sessions of a user.
+        
+        Args:
+            user_id: The user identifier given to create_session
+            
+        Returns:
+            List: (session_id, session data) pairs
+        """
+        # 通过 user_id 索引直接定位，不扫描全部会话；冻结计时器，避免遍历过程中有会话恰好过期
+        with self._session_data.timer:
+            session_ids = list(self._session_data.by_user.get(user_id, ()))
+            return [
+                (session_id, self._session_data[session_id])
+                for session_id in session_ids
+                if session_id in self._session_data
+            ]
+    
     def add_message_to_session(self, session_id: str, role: str, content: str) -> bool:
         """
         Add a message to a session.
@@ -144,15 +252,29 @@ class AgentManager:
         Returns:
             bool: Whether the message was added
         """
+        return self.add_messages_to_session(session_id, [(role, content)])
+    
+    def add_messages_to_session(self, session_id: str, messages: List[Tuple[str, str]]) -> bool:
+        """
+        Add several messages to a session at once.
+        
+        Args:
+            session_id: The session ID
+            messages: (role, content) pairs in order
+            
+        Returns:
+            bool: Whether the messages were added
+        """
         session = self.get_session(session_id)
         if not session:
             return False
         
-        session["messages"].append({
-            "role": role,
-            "content": content,
-            "timestamp": datetime.utcnow().isoformat()
-        })
+        # 会话只查找一次，同一批消息共用一个时间戳
+        timestamp = datetime.utcnow().isoformat()
+        session["messages"].extend(
+            {"role": role, "content": content, "timestamp": timestamp}
+            for role, content in messages
+        )
         
         return True
     
@@ -179,65 +301,32 @@ class AgentManager:
         Returns:
             int: Number of agents cleaned up
         """
-        now = datetime.utcnow()
-        to_remove = []
+        # TTLCache 在访问时才惰性淘汰，这里定期主动清理以及时释放 Agent 和会话
+        self._session_data.expire()
+        expired = self._agents.expire()
         
-        async with self._lock:
-            for assistant_id, last_used in self._last_used.items():
-                if now - last_used > self._max_idle_time:
-                    to_remove.append(assistant_id)
-            
-            for assistant_id in to_remove:
-                if assistant_id in self._agents:
-                    del self._agents[assistant_id]
-                if assistant_id in self._agent_info:
-                    del self._agent_info[assistant_id]
-                if assistant_id in self._last_used:
-                    del self._last_used[assistant_id]
-            
-            logger.info(f"Cleaned up {len(to_remove)} idle agents")
-            return len(to_remove)
+        # 构建锁只在构建期间有用，移除未被持有的锁，避免按助手 ID 无限增长
+        for assistant_id, lock in list(self._build_locks.items()):
+            if not lock.locked():
+                del self._build_locks[assistant_id]
+        
+        logger.info(f"Cleaned up {len(expired)} idle agents")
+        return len(expired)
     
     async def _get_tool_ids_for_assistant(self, assistant: Dict[str, Any]) -> List[int]:
-        """Get tool IDs for an assistant."""
-        assistant_id = assistant["id"]
-        
+        """Get tool IDs for an assistant loaded with get_assistant_with_tools."""
         if assistant["type"] == "dedicated":
-            # For dedicated assistants, get the associated tools
-            assistant_with_tools = await AssistantQueries.get_assistant_with_tools(assistant_id)
-            # Ensure tools is a list
-            if not isinstance(assistant_with_tools["tools"], list):
-                import json
-                if isinstance(assistant_with_tools["tools"], str):
-                    try:
-                        assistant_with_tools["tools"] = json.loads(assistant_with_tools["tools"])
-                    except json.JSONDecodeError:
-                        assistant_with_tools["tools"] = []
-                else:
-                    assistant_with_tools["tools"] = []
-            
-            # Get tool IDs sorted by priority
-            tool_ids = [
-                tool["id"] for tool in sorted(
-                    assistant_with_tools["tools"], 
-                    key=lambda x: x.get("priority", 999)
-                )
-            ]
-            
-        else:  # Universal assistant
-            # For universal assistants, we'll use all available tools
-            # In a real implementation, you'd use vector search to find relevant tools
-            # based on the query, but for simplicity we'll use all enabled tools
-            from app.db.queries import MCPToolQueries
-            tools_data = await MCPToolQueries.list_enabled_tools()
-            tool_ids = [tool["id"] for tool in tools_data]
-            
-            # Limit to max_tools if specified
-            max_tools = assistant.get("max_tools", 5)
-            if len(tool_ids) > max_tools:
-                tool_ids = tool_ids[:max_tools]
+            # For dedicated assistants, use the associated tools (already sorted by priority in SQL)
+            return [tool["id"] for tool in assistant["tools"]]
+        
+        # For universal assistants, we'll use all available tools
+        # In a real implementation, you'd use vector search to find relevant tools
+        # based on the query, but for simplicity we'll use all enabled tools
+        tool_ids = await get_enabled_tool_ids_cached()
         
-        return tool_ids
+        # Limit to max_tools if specified
+        max_tools = assistant.get("max_tools", 5)
+        return list(tool_ids[:max_tools])
 
 
 # Global agent manager instance
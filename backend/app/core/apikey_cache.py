@@ -0,0 +1,142 @@
+"""
+In-process caches for API key records and key-to-assistant access checks.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, FrozenSet, Optional, Tuple
+
+from cachetools import TTLCache
+
+from app.config import settings
+from app.db.api_key_queries import APIKeyQueries, APIKeyAssistantQueries
+from app.utils.datetime_utils import to_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+class APIKeyCache:
+    """TTL + LRU cache of API key records keyed by key hash."""
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 60, last_used_interval: float = 30):
+        # 所有操作都是同步的，中间没有 await，在事件循环内天然是原子的
+        self._records: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)  # key_hash -> (record, expires_ts)
+        self._hash_by_id: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)  # key_id -> key_hash
+        self._last_used_touched: TTLCache = TTLCache(maxsize=maxsize, ttl=last_used_interval)  # key_id -> True
+
+    def get(self, key_hash: str) -> Optional[Tuple[Dict[str, Any], Optional[float]]]:
+        """Get cached API key record and its expiry as a Unix timestamp."""
+        return self._records.get(key_hash)
+
+    def set(self, key_hash: str, record: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[float]]:
+        """Cache an API key record under its hash."""
+        # 预先把 expires_at 转换成时间戳，鉴权时直接和 time.time() 比较
+        entry = (record, to_timestamp(record.get("expires_at")))
+        self._records[key_hash] = entry
+        self._hash_by_id[record["id"]] = key_hash
+        return entry
+
+    def should_touch_last_used(self, key_id: int) -> bool:
+        """Whether last_used_at of a key is due for an update; marks it as updated."""
+        # 条目过期前的请求不再写库，每个 Key 每个间隔最多一次 UPDATE
+        if key_id in self._last_used_touched:
+            return False
+        self._last_used_touched[key_id] = True
+        return True
+
+    def invalidate(self, key_hash: str) -> None:
+        """Evict an API key record by hash."""
+        entry = self._records.pop(key_hash, None)
+        if entry:
+            self._hash_by_id.pop(entry[0]["id"], None)
+
+    def invalidate_id(self, key_id: int) -> None:
+        """Evict an API key record by ID."""
+        key_hash = self._hash_by_id.pop(key_id, None)
+        if key_hash:
+            self._records.pop(key_hash, None)
+
+    def clear(self) -> None:
+        """Evict all cached records."""
+        self._records.clear()
+        self._hash_by_id.clear()
+        self._last_used_touched.clear()
+
+
+class KeyAccessCache:
+    """TTL + LRU cache of the assistant IDs each API key may call."""
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 60):
+        self._allowed: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)  # key_id -> frozenset(assistant_id)
+
+    def get(self, key_id: int) -> Optional[FrozenSet[int]]:
+        """Get cached allowed assistant IDs, or None if not cached."""
+        return self._allowed.get(key_id)
+
+    def set(self, key_id: int, assistant_ids: FrozenSet[int]) -> None:
+        """Cache the allowed assistant IDs of an API key."""
+        self._allowed[key_id] = assistant_ids
+
+    def invalidate_key(self, key_id: int) -> None:
+        """Evict the entry of an API key."""
+        self._allowed.pop(key_id, None)
+
+    def invalidate_assistant(self, assistant_id: int) -> None:
+        """Evict all entries that include an assistant."""
+        # 只在删除助手时调用，遍历整个缓存的开销可以接受
+        for key_id in [key_id for key_id, ids in list(self._allowed.items()) if assistant_id in ids]:
+            self._allowed.pop(key_id, None)
+
+    def clear(self) -> None:
+        """Evict all cached entries."""
+        self._allowed.clear()
+
+
+# 全局 API Key 缓存实例
+apikey_cache = APIKeyCache(
+    maxsize=settings.api_key_cache_size,
+    ttl=settings.api_key_cache_ttl,
+    last_used_interval=settings.api_key_last_used_interval,
+)
+
+# 全局访问权限缓存实例，与 API Key 记录使用相同的容量和过期时间
+key_access_cache = KeyAccessCache(
+    maxsize=settings.api_key_cache_size,
+    ttl=settings.api_key_cache_ttl,
+)
+
+
+# key_hash -> 正在进行的查询；只保存进行中的查询，不会随无效 Key 增长
+_pending_lookups: Dict[str, asyncio.Future] = {}
+
+
+async def get_api_key_by_hash_cached(key_hash: str) -> Optional[Tuple[Dict[str, Any], Optional[float]]]:
+    """Get an API key record and its expiry timestamp by hash, served from the cache when possible."""
+    entry = apikey_cache.get(key_hash)
+    if entry is not None:
+        return entry
+    
+    # 同一个 Key 的并发未命中合并为一次查询
+    lookup = _pending_lookups.get(key_hash)
+    if lookup is None:
+        lookup = asyncio.ensure_future(APIKeyQueries.get_api_key_by_hash(key_hash))
+        _pending_lookups[key_hash] = lookup
+        lookup.add_done_callback(lambda _: _pending_lookups.pop(key_hash, None))
+    # shield：某个请求被取消时不影响其他等待同一查询的请求
+    key_record = await asyncio.shield(lookup)
+    if not key_record:
+        return None
+    return apikey_cache.set(key_hash, key_record)
+
+
+async def get_allowed_assistant_ids_cached(key_id: int) -> FrozenSet[int]:
+    """Get the assistant IDs an API key may call, served from the cache when possible."""
+    allowed = key_access_cache.get(key_id)
+    if allowed is None:
+        allowed = frozenset(await APIKeyAssistantQueries.list_allowed_assistant_ids(key_id))
+        key_access_cache.set(key_id, allowed)
+    return allowed
+
+
+async def check_key_assistant_access_cached(key_id: int, assistant_id: int) -> bool:
+    """Check API key access to an assistant, served from the cache when possible."""
+    return assistant_id in await get_allowed_assistant_ids_cached(key_id)
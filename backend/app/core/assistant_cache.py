@@ -0,0 +1,47 @@
+"""
+In-process cache for looking up enabled assistants by name.
+"""
+import logging
+from typing import Any, Dict, Optional
+
+from cachetools import TTLCache
+
+from app.config import settings
+from app.db.assistant_queries import AssistantQueries
+
+logger = logging.getLogger(__name__)
+
+# 不存在的名称也缓存，避免未知模型名的请求反复查库
+_MISSING: Dict[str, Any] = {}
+
+
+class AssistantNameCache:
+    """TTL + LRU cache of enabled assistants keyed by the requested name."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30):
+        self._assistants: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)  # name -> assistant or _MISSING
+        # 每次失效时递增，防止失效前开始的查询把旧结果写回缓存
+        self._version = 0
+
+    async def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """Get an enabled assistant by name, preferring an exact match."""
+        assistant = self._assistants.get(name)
+        if assistant is None:
+            version = self._version
+            assistant = await AssistantQueries.get_enabled_assistant_by_name_ci(name) or _MISSING
+            if version == self._version:
+                self._assistants[name] = assistant
+        return assistant if assistant is not _MISSING else None
+
+    def invalidate(self) -> None:
+        """Drop all cached lookups so the next request reloads them."""
+        # 改名或启停会影响任意名称的查找结果，整体清空
+        self._version += 1
+        self._assistants.clear()
+
+
+# 全局助手名称缓存实例
+assistant_name_cache = AssistantNameCache(
+    maxsize=settings.assistant_cache_size,
+    ttl=settings.assistant_cache_ttl,
+)
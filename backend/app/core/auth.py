@@ -1,12 +1,13 @@
 """
 Authentication utilities for API endpoints.
 """
+import time
 from typing import Optional, Dict, Any
-from datetime import datetime
 from fastapi import Depends, HTTPException, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from app.db.api_key_queries import APIKeyQueries
+from app.core.apikey_cache import apikey_cache, get_api_key_by_hash_cached
 
 security = HTTPBearer()
 
@@ -38,19 +39,21 @@ async def get_api_key_by_value(api_key: str) -> Optional[Dict[str, Any]]:
         return None
     
     key_hash = APIKeyQueries.hash_api_key(api_key)
-    key_record = await APIKeyQueries.get_api_key_by_hash(key_hash)
+    entry = await get_api_key_by_hash_cached(key_hash)
     
-    if not key_record:
+    if not entry:
         return None
+    key_record, expires_ts = entry
     
     if key_record["is_disabled"]:
         return None
     
-    if key_record["expires_at"] and key_record["expires_at"] < datetime.utcnow():
+    if expires_ts is not None and expires_ts < time.time():
         return None
     
-    # Update last used timestamp
-    await APIKeyQueries.update_last_used(key_record["id"])
+    # Update last used timestamp (at most once per interval per key)
+    if apikey_cache.should_touch_last_used(key_record["id"]):
+        await APIKeyQueries.update_last_used(key_record["id"])
     
     return key_record
 
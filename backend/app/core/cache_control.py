@@ -0,0 +1,27 @@
+"""
+HTTP caching headers for read-only endpoints.
+"""
+from typing import Callable, Dict
+
+
+def cache_control(max_age: int, private: bool = True) -> Callable[[], Dict[str, str]]:
+    """Build a dependency that returns Cache-Control and Vary headers.
+
+    ``max_age=0`` yields ``no-cache``, so clients revalidate on every request;
+    use it for data that the UI edits and immediately refetches.
+
+    Endpoints take the headers as a parameter and pass them to the Response
+    they return, e.g. ``ORJSONResponse(data, headers=cache_headers)``.
+    Headers set on an injected Response would be dropped once the endpoint
+    returns its own Response object.
+    """
+    # 所有接口都需要 API Key 认证，默认只允许客户端缓存，不允许共享缓存
+    scope = "private" if private else "public"
+    value = f"{scope}, max-age={max_age}" if max_age > 0 else f"{scope}, no-cache"
+    # 响应内容取决于 API Key，切换 Key 后不能复用之前 Key 的缓存
+    headers = {"Cache-Control": value, "Vary": "Authorization"}
+
+    def cache_headers() -> Dict[str, str]:
+        return dict(headers)
+
+    return cache_headers
@@ -3,7 +3,8 @@ MCP Server Manager for dynamic loading and management of MCP clients.
 """
 import asyncio
 import logging
-from typing import Dict, List, Optional, Any
+import weakref
+from typing import Dict, FrozenSet, List, Optional, Any
 from contextlib import asynccontextmanager
 from datetime import datetime
 
@@ -13,8 +14,9 @@ from mcp.client.sse import sse_client
 from mcp.client.streamable_http import streamablehttp_client
 from strands import Agent
 from strands.tools.mcp import MCPClient
+from strands_tools import calculator, current_time, http_request
 
-from app.db.queries import MCPToolQueries
+from app.core.tool_cache import get_tool_by_id_cached
 
 logger = logging.getLogger(__name__)
 
@@ -29,10 +31,32 @@ class MCPServerManager:
         self._active_clients: Dict[int, bool] = {}  # tool_id -> is_active
         self._tools_cache: Dict[int, List[Any]] = {}  # tool_id -> tools
         self._agents_cache: Dict[str, Agent] = {}  # tool_ids_key -> Agent
+        # 每个 Agent 一把锁：Agent 会在 messages 中累积对话，同一实例不能并发调用
+        self._agent_locks: "weakref.WeakKeyDictionary[Agent, asyncio.Lock]" = weakref.WeakKeyDictionary()
+        # 运行中工具 ID 的只读快照，仅在启动/停止时整体替换（copy-on-write），读取无需加锁或复制
+        self._running_ids: FrozenSet[int] = frozenset()
+        # 所有 Agent 共用的模型实例，首次创建 Agent 时构造
+        self._model: Any = None
+        self._model_created = False
         logger.info("MCP Server Manager initialized")
     
+    @staticmethod
+    def _enter_client(client: MCPClient) -> List[Any]:
+        """Enter a client context and list its tools, exiting it again on failure."""
+        client.__enter__()
+        try:
+            return client.list_tools_sync()
+        except BaseException:
+            client.__exit__(None, None, None)
+            raise
+    
     async def start_mcp_server(self, tool_config: Dict[str, Any]) -> bool:
         """Start an MCP server based on tool configuration."""
+        # 线程中的 __enter__ 无法被中断；调用方（如断开的请求）被取消时仍让启动完整执行并登记客户端，避免进程泄漏
+        return await asyncio.shield(self._start_mcp_server(tool_config))
+    
+    async def _start_mcp_server(self, tool_config: Dict[str, Any]) -> bool:
+        """Start an MCP server; see start_mcp_server."""
         tool_id = tool_config["id"]
         
         async with self._lock:
@@ -61,13 +85,12 @@ class MCPServerManager:
                 
                 # 初始化客户端并缓存工具
                 try:
-                    # 进入客户端上下文
-                    mcp_client.__enter__()
+                    # 进入客户端上下文并获取工具（同步调用，会等待服务器完成初始化，放到线程池执行）；
+                    # 获取工具失败时在同一线程中退出上下文，不留下半初始化的客户端
+                    tools = await asyncio.to_thread(self._enter_client, mcp_client)
                     self._active_clients[tool_id] = True
-                    
-                    # 获取并缓存工具
-                    tools = mcp_client.list_tools_sync()
                     self._tools_cache[tool_id] = tools
+                    self._running_ids = self._running_ids | {tool_id}
                     
                     logger.info(f"Started and initialized MCP server for tool {tool_id}: {tool_config['name']}")
                 except Exception as e:
@@ -87,6 +110,11 @@ class MCPServerManager:
     
     async def stop_mcp_server(self, tool_id: int) -> bool:
         """Stop an MCP server."""
+        # 与启动相同，取消调用方时仍完整执行退出和清理
+        return await asyncio.shield(self._stop_mcp_server(tool_id))
+    
+    async def _stop_mcp_server(self, tool_id: int) -> bool:
+        """Stop an MCP server; see stop_mcp_server."""
         async with self._lock:
             if tool_id not in self._clients:
                 logger.warning(f"MCP server for tool {tool_id} is not running")
@@ -99,12 +127,13 @@ class MCPServerManager:
                 # 如果客户端处于活跃状态，退出上下文
                 if tool_id in self._active_clients and self._active_clients[tool_id]:
                     try:
-                        client.__exit__(None, None, None)
+                        await asyncio.to_thread(client.__exit__, None, None, None)
                         self._active_clients[tool_id] = False
                     except Exception as e:
                         logger.error(f"Error exiting client context for tool {tool_id}: {e}")
                 
                 # Remove from tracking
+                self._running_ids = self._running_ids - {tool_id}
                 del self._clients[tool_id]
                 if tool_id in self._client_info:
                     del self._client_info[tool_id]
@@ -114,14 +143,7 @@ class MCPServerManager:
                     del self._tools_cache[tool_id]
                 
                 # 清理相关的 agent 缓存
-                agents_to_remove = []
-                for key in self._agents_cache:
-                    if str(tool_id) in key.split(','):
-                        agents_to_remove.append(key)
-                
-                for key in agents_to_remove:
-                    if key in self._agents_cache:
-                        del self._agents_cache[key]
+                self.invalidate_tool(tool_id)
                 
                 logger.info(f"Stopped MCP server for tool {tool_id}")
                 return True
@@ -130,6 +152,18 @@ class MCPServerManager:
                 logger.error(f"Failed to stop MCP server for tool {tool_id}: {e}")
                 return False
     
+    def invalidate_tool(self, tool_id: int) -> int:
+        """Evict cached agents built with a tool.
+        
+        Returns:
+            int: Number of agents evicted
+        """
+        tool_key = str(tool_id)
+        stale = [key for key in self._agents_cache if tool_key in key.split(',')]
+        for key in stale:
+            self._agents_cache.pop(key, None)
+        return len(stale)
+    
     async def restart_mcp_server(self, tool_config: Dict[str, Any]) -> bool:
         """Restart an MCP server."""
         tool_id = tool_config["id"]
@@ -155,7 +189,11 @@ class MCPServerManager:
     
     def is_running(self, tool_id: int) -> bool:
         """Check if MCP server is running for a tool."""
-        return tool_id in self._clients
+        return tool_id in self._running_ids
+    
+    def running_tool_ids(self) -> FrozenSet[int]:
+        """Get a snapshot of the tool IDs with a running MCP server."""
+        return self._running_ids
     
     def is_active(self, tool_id: int) -> bool:
         """Check if MCP client is active (context entered)."""
@@ -174,11 +212,11 @@ class MCPServerManager:
         try:
             # 如果客户端不活跃，进入上下文
             if not self.is_active(tool_id):
-                client.__enter__()
+                await asyncio.to_thread(client.__enter__)
                 self._active_clients[tool_id] = True
             
             # 获取工具
-            tools = client.list_tools_sync()
+            tools = await asyncio.to_thread(client.list_tools_sync)
             
             # 缓存工具
             self._tools_cache[tool_id] = tools
@@ -188,6 +226,39 @@ class MCPServerManager:
             logger.error(f"Failed to get tools from MCP client {tool_id}: {e}")
             return None
     
+    async def _load_client_tools(self, tool_id: int) -> List[Any]:
+        """Start the MCP server for a tool if needed and return its tools."""
+        try:
+            if not self.is_running(tool_id):
+                # 尝试启动服务器（配置走工具缓存，多个助手同时冷启动时不重复查库）
+                tool_config = await get_tool_by_id_cached(tool_id)
+                if not tool_config:
+                    logger.warning(f"Tool {tool_id} not found in database")
+                    return []
+                
+                success = await self.start_mcp_server(tool_config)
+                # 并发加载时可能已被其他调用启动
+                if not success and not self.is_running(tool_id):
+                    logger.warning(f"Failed to start MCP server for tool {tool_id}")
+                    return []
+            
+            # 获取工具
+            tools = await self.get_tools_from_client(tool_id)
+            if not tools:
+                logger.warning(f"No tools found for tool ID {tool_id}")
+                return []
+            return tools
+        except Exception as e:
+            logger.error(f"Error processing tool {tool_id}: {e}")
+            return []
+    
+    def agent_lock(self, agent: Agent) -> asyncio.Lock:
+        """Get the lock that serializes calls to a (possibly shared) agent."""
+        lock = self._agent_locks.get(agent)
+        if lock is None:
+            lock = self._agent_locks[agent] = asyncio.Lock()
+        return lock
+    
     async def get_agent_for_tools(self, tool_ids: List[int]) -> Optional[Agent]:
         """Get an agent with tools for specified tool IDs.
         
@@ -197,90 +268,43 @@ class MCPServerManager:
         Returns:
             Agent instance or None if failed
         """
-
-        from strands_tools import calculator, current_time, http_request
+        # 生成缓存键；排序以确保相同的工具集合生成相同的键，空集合对应只有内置工具的 Agent
+        cache_key = ','.join(map(str, sorted(tool_ids)))
+        
+        # 检查缓存（在创建模型之前，命中时不再构造模型客户端）
+        if cache_key in self._agents_cache:
+            logger.info(f"Using cached agent for tools {cache_key}")
+            return self._agents_cache[cache_key]
+        
         # Add built-in tools to the list of tools
         built_in_tools = [calculator, current_time, http_request]
-
-        # Import built-in tools from strands_tools package
+        
         try:
-            # Create model based on environment variables
-            model = self._create_model_from_env()
-            
-            # Log model configuration details
-            # if model:
-            #     model_type = model.__class__.__name__
-            #     model_id = getattr(model, 'model_id', 'unknown')
-            #     logger.info(f"Creating Agent with model provider: {model_type}, model ID: {model_id}")
-                
-            #     # Log additional model parameters if available
-            #     params = {}
-            #     if hasattr(model, 'params'):
-            #         params = model.params
-            #     elif hasattr(model, 'temperature'):
-            #         params['temperature'] = model.temperature
-            #     if params:
-            #         logger.info(f"Model parameters: {params}")
-            # else:
-            #     logger.warning("No model provider configured, using default model")
+            # Get the shared model based on environment variables
+            model = self._get_model()
         except Exception as e:
             logger.error(f"Error creating model: {e}")
             model = None
         
-
         if not tool_ids:
             logger.warning("No tool IDs provided for agent creation")
-            return Agent(tools=built_in_tools, model=model)
+            agent = Agent(tools=built_in_tools, model=model)
+            self._agents_cache[cache_key] = agent
+            return agent
             
         try:
-            # 生成缓存键
-            sorted_tool_ids = sorted(tool_ids)  # 排序以确保相同的工具集合生成相同的键
-            cache_key = ','.join(map(str, sorted_tool_ids))
-            
-            # 检查缓存
-            if cache_key in self._agents_cache:
-                logger.info(f"Using cached agent for tools {cache_key}")
-                return self._agents_cache[cache_key]
-            
-            # 确保所有客户端都在运行并处于活跃状态
+            # 确保所有客户端都在运行并处于活跃状态；各工具并发加载，结果按 tool_ids 顺序合并
             all_tools = []
-            for tool_id in tool_ids:
-                try:
-                    if not self.is_running(tool_id):
-                        # 尝试启动服务器
-                        tool_config = await MCPToolQueries.get_tool_by_id(tool_id)
-                        if not tool_config:
-                            logger.warning(f"Tool {tool_id} not found in database")
-                            continue
-                        
-                        success = await self.start_mcp_server(tool_config)
-                        if not success:
-                            logger.warning(f"Failed to start MCP server for tool {tool_id}")
-                            continue
-                    
-                    # 获取工具
-                    tools = await self.get_tools_from_client(tool_id)
-                    if tools:
-                        all_tools.extend(tools)
-                    else:
-                        logger.warning(f"No tools found for tool ID {tool_id}")
-                except Exception as e:
-                    logger.error(f"Error processing tool {tool_id}: {e}")
-                    continue
+            for tools in await asyncio.gather(*(self._load_client_tools(tool_id) for tool_id in tool_ids)):
+                all_tools.extend(tools)
             
-
-
             if not all_tools:
+                # 工具可能稍后才能启动，不缓存，下次请求重新尝试
                 logger.warning("No tools available for agent creation")
                 return Agent(tools=built_in_tools, model=model)
             
-            # Import built-in tools from strands_tools package
-            try:
-                all_tools.extend(built_in_tools)
-                
-                logger.info(f"Added built-in tools: calculator, current_time, http_request")
-            except ImportError as e:
-                logger.warning(f"Could not import built-in tools from strands_tools: {e}")
+            all_tools.extend(built_in_tools)
+            logger.info(f"Added built-in tools: calculator, current_time, http_request")
             
             # Create the agent with the model
             agent = Agent(tools=all_tools, model=model)
@@ -350,15 +374,23 @@ class MCPServerManager:
         
         return sse_mcp_client
         
+    def _get_model(self):
+        """Get the model shared by all agents, creating it on first use."""
+        # 模型持有 provider SDK 的 HTTP 客户端（带 keep-alive 连接池）；共用一个实例，
+        # Agent 重建或新增时复用已建立的连接，不再为每个 Agent 重新建连和 TLS 握手
+        if not self._model_created:
+            self._model = self._create_model_from_env()
+            self._model_created = True
+        return self._model
+    
     def _create_model_from_env(self):
         """Create a model instance based on environment variables."""
         import os
         
         # Get model provider from environment variables
         model_provider = os.getenv("MODEL_PROVIDER", "openai").lower()
-        print("-------model_provider---------", model_provider)
         model_name = os.getenv("MODEL_NAME", "gpt-4")
-        print("-------model_name---------", model_name)
+        logger.debug(f"Creating model: provider={model_provider}, name={model_name}")
         
         try:
             if model_provider == "openai":
@@ -416,7 +448,6 @@ class MCPServerManager:
                 aws_region = os.getenv("AWS_REGION", "us-east-1")
                 
                 logger.info(f"Creating AWS Bedrock model: {model_name}")
-                logger.info(f"--aws_access_key-----{aws_access_key}---------")
                 
                 # Create client args based on available credentials
                 client_args = {}
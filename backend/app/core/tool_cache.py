@@ -0,0 +1,79 @@
+"""
+In-process cache for MCP tool configurations.
+"""
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from cachetools import TTLCache
+
+from app.config import settings
+from app.db.queries import MCPToolQueries
+
+logger = logging.getLogger(__name__)
+
+
+class ToolCache:
+    """TTL + LRU cache of MCP tool records keyed by tool ID."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30):
+        # 与 API Key 缓存相同，所有操作都是同步的，在事件循环内天然是原子的
+        self._tools: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)  # tool_id -> record
+        self._enabled_ids: TTLCache = TTLCache(maxsize=1, ttl=ttl)  # "enabled" -> 按创建时间排序的启用工具 ID
+
+    def get(self, tool_id: int) -> Optional[Dict[str, Any]]:
+        """Get cached tool record by ID."""
+        return self._tools.get(tool_id)
+
+    def set(self, tool_id: int, tool: Dict[str, Any]) -> None:
+        """Cache a tool record."""
+        self._tools[tool_id] = tool
+
+    def get_enabled_ids(self) -> Optional[Tuple[int, ...]]:
+        """Get cached IDs of enabled tools."""
+        return self._enabled_ids.get("enabled")
+
+    def set_enabled_ids(self, tool_ids: Tuple[int, ...]) -> None:
+        """Cache IDs of enabled tools."""
+        self._enabled_ids["enabled"] = tool_ids
+
+    def invalidate_enabled(self) -> None:
+        """Evict the enabled tool IDs, e.g. after a tool is created."""
+        self._enabled_ids.clear()
+
+    def invalidate(self, tool_id: int) -> None:
+        """Evict a tool record by ID."""
+        self._tools.pop(tool_id, None)
+        # 更新、删除或启停都可能改变启用工具列表
+        self._enabled_ids.clear()
+
+    def clear(self) -> None:
+        """Evict all cached records."""
+        self._tools.clear()
+        self._enabled_ids.clear()
+
+
+# 全局工具缓存实例
+tool_cache = ToolCache(
+    maxsize=settings.tool_cache_size,
+    ttl=settings.tool_cache_ttl,
+)
+
+
+async def get_tool_by_id_cached(tool_id: int) -> Optional[Dict[str, Any]]:
+    """Get MCP tool by ID, served from the cache when possible."""
+    tool = tool_cache.get(tool_id)
+    if tool is None:
+        tool = await MCPToolQueries.get_tool_by_id(tool_id)
+        if tool:
+            tool_cache.set(tool_id, tool)
+    return tool
+
+
+async def get_enabled_tool_ids_cached() -> Tuple[int, ...]:
+    """Get IDs of all enabled tools in creation order, served from the cache when possible."""
+    tool_ids = tool_cache.get_enabled_ids()
+    if tool_ids is None:
+        tools = await MCPToolQueries.list_enabled_tools()
+        tool_ids = tuple(tool["id"] for tool in tools)
+        tool_cache.set_enabled_ids(tool_ids)
+    return tool_ids
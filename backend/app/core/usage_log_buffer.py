@@ -0,0 +1,113 @@
+"""
+Buffered writer for API key usage logs.
+"""
+import asyncio
+import ipaddress
+import logging
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from app.db.api_key_queries import APIKeyUsageLogQueries
+
+logger = logging.getLogger(__name__)
+
+
+class UsageLogBuffer:
+    """Collect usage log rows in memory and write them to the database in batches."""
+
+    def __init__(self, flush_interval: float = 0.1, batch_size: int = 500, max_queue_size: int = 10000):
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    def add(
+        self,
+        api_key_id: int,
+        endpoint: str,
+        status_code: int,
+        assistant_id: int = None,
+        ip_address: str = None,
+        user_agent: str = None,
+        request_size: int = None,
+        response_size: int = None,
+        error_message: str = None
+    ) -> None:
+        """Queue a usage log row without waiting for the database."""
+        # 非法地址会让整批 COPY 失败，提前丢弃
+        if ip_address:
+            try:
+                ip_address = str(ipaddress.ip_address(ip_address))
+            except ValueError:
+                ip_address = None
+        
+        # 在入队时记录时间，保证批量写入后 created_at 仍是请求发生的时间
+        record = (
+            api_key_id, endpoint, assistant_id, ip_address, user_agent,
+            request_size, response_size, status_code, error_message,
+            datetime.now(timezone.utc).replace(tzinfo=None),
+        )
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            logger.warning("Usage log buffer is full, dropping log entry")
+
+    def start(self) -> None:
+        """Start the background flush task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background flush task and write any remaining rows."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while not self._queue.empty():
+            await self._flush(self._drain())
+
+    def _drain(self) -> List[Tuple]:
+        """Take up to one batch of rows from the queue without waiting."""
+        records = []
+        while len(records) < self._batch_size and not self._queue.empty():
+            records.append(self._queue.get_nowait())
+        return records
+
+    async def _flush(self, records: List[Tuple]) -> None:
+        """Write a batch of rows, logging instead of raising on failure."""
+        if not records:
+            return
+        try:
+            await APIKeyUsageLogQueries.log_usage_batch(records)
+        except Exception as e:
+            logger.error(f"Failed to write {len(records)} usage log entries: {e}")
+
+    async def _run(self) -> None:
+        """Flush every interval, or as soon as a full batch is queued."""
+        loop = asyncio.get_running_loop()
+        while True:
+            records = []
+            try:
+                # 等待第一条记录，然后在一个刷新间隔内尽量凑满一批
+                records.append(await self._queue.get())
+                deadline = loop.time() + self._flush_interval
+                while len(records) < self._batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        records.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                # 停止时把已取出的记录写完再退出
+                await self._flush(records)
+                raise
+            await self._flush(records)
+
+
+# 全局使用日志缓冲实例
+usage_log_buffer = UsageLogBuffer()
@@ -13,6 +13,12 @@ from app.utils.datetime_utils import parse_datetime
 class APIKeyQueries:
     """API Key related queries."""
     
+    # 可以直接返回给客户端的列（不含 key_hash）
+    PUBLIC_COLUMNS = (
+        "id, name, key_prefix, can_manage, can_call_assistant, is_disabled, "
+        "created_by, last_used_at, expires_at, created_at, updated_at"
+    )
+    
     @staticmethod
     def generate_api_key() -> tuple[str, str, str]:
         """Generate a new API key.
@@ -35,7 +41,11 @@ class APIKeyQueries:
     
     @staticmethod
     def hash_api_key(api_key: str) -> str:
-        """Hash an API key for storage."""
+        """Hash an API key for storage.
+
+        A single SHA-256 round takes microseconds, so it runs inline on the
+        event loop; handing it to a thread pool would cost more than it saves.
+        """
         return hashlib.sha256(api_key.encode()).hexdigest()
     
     @staticmethod
@@ -86,12 +96,12 @@ class APIKeyQueries:
     
     @staticmethod
     async def list_api_keys(include_disabled: bool = False) -> List[Dict[str, Any]]:
-        """List all API keys."""
+        """List all API keys (without key hashes)."""
         if include_disabled:
-            query = "SELECT * FROM api_key ORDER BY created_at DESC"
+            query = f"SELECT {APIKeyQueries.PUBLIC_COLUMNS} FROM api_key ORDER BY created_at DESC"
             return await db_manager.fetch_all(query)
         else:
-            query = "SELECT * FROM api_key WHERE is_disabled = false ORDER BY created_at DESC"
+            query = f"SELECT {APIKeyQueries.PUBLIC_COLUMNS} FROM api_key WHERE is_disabled = false ORDER BY created_at DESC"
             return await db_manager.fetch_all(query)
     
     @staticmethod
@@ -153,11 +163,14 @@ class APIKeyQueries:
         return await db_manager.fetch_one(query, *params)
     
     @staticmethod
-    async def delete_api_key(api_key_id: int) -> bool:
-        """Delete API key."""
-        query = "DELETE FROM api_key WHERE id = $1"
-        result = await db_manager.execute(query, api_key_id)
-        return "DELETE 1" in result
+    async def delete_api_key(api_key_id: int) -> Optional[str]:
+        """Delete API key.
+        
+        Returns:
+            The deleted key's hash, or None if the key does not exist
+        """
+        query = "DELETE FROM api_key WHERE id = $1 RETURNING key_hash"
+        return await db_manager.fetch_val(query, api_key_id)
     
     @staticmethod
     async def update_last_used(api_key_id: int) -> None:
@@ -171,12 +184,26 @@ class APIKeyAssistantQueries:
     
     @staticmethod
     async def bind_assistant_to_key(api_key_id: int, assistant_id: int) -> Dict[str, Any]:
-        """Bind an assistant to an API key."""
+        """Bind an assistant to an API key.
+        
+        Returns:
+            dict with ``key_exists`` and ``assistant_exists``; the binding is
+            only created when both exist.
+        """
+        # 存在性检查和插入合并为一条语句
         query = """
-            INSERT INTO api_key_assistant (api_key_id, assistant_id)
-            VALUES ($1, $2)
-            ON CONFLICT (api_key_id, assistant_id) DO NOTHING
-            RETURNING *
+            WITH k AS (
+                SELECT EXISTS(SELECT 1 FROM api_key WHERE id = $1) AS key_exists
+            ), a AS (
+                SELECT EXISTS(SELECT 1 FROM assistant WHERE id = $2) AS assistant_exists
+            ), ins AS (
+                INSERT INTO api_key_assistant (api_key_id, assistant_id)
+                SELECT $1, $2
+                FROM k, a
+                WHERE k.key_exists AND a.assistant_exists
+                ON CONFLICT (api_key_id, assistant_id) DO NOTHING
+            )
+            SELECT k.key_exists, a.assistant_exists FROM k, a
         """
         return await db_manager.fetch_one(query, api_key_id, assistant_id)
     
@@ -188,16 +215,25 @@ class APIKeyAssistantQueries:
         return "DELETE 1" in result
     
     @staticmethod
-    async def get_key_assistants(api_key_id: int) -> List[Dict[str, Any]]:
-        """Get all assistants for an API key."""
+    async def get_key_assistants(api_key_id: int) -> Optional[List[Dict[str, Any]]]:
+        """Get all assistants for an API key.
+        
+        Returns:
+            List of assistants, or None if the API key does not exist
+        """
+        # 从 api_key 出发 LEFT JOIN：Key 不存在时无行，存在但无助手时返回一行空值
         query = """
             SELECT a.*, aka.created_at as bound_at
-            FROM assistant a
-            JOIN api_key_assistant aka ON a.id = aka.assistant_id
-            WHERE aka.api_key_id = $1 AND a.enabled = true
+            FROM api_key ak
+            LEFT JOIN api_key_assistant aka ON ak.id = aka.api_key_id
+            LEFT JOIN assistant a ON a.id = aka.assistant_id AND a.enabled = true
+            WHERE ak.id = $1
             ORDER BY aka.created_at
         """
-        return await db_manager.fetch_all(query, api_key_id)
+        rows = await db_manager.fetch_all(query, api_key_id)
+        if not rows:
+            return None
+        return [row for row in rows if row["id"] is not None]
     
     @staticmethod
     async def get_assistant_keys(assistant_id: int) -> List[Dict[str, Any]]:
@@ -212,36 +248,36 @@ class APIKeyAssistantQueries:
         return await db_manager.fetch_all(query, assistant_id)
     
     @staticmethod
-    async def check_key_assistant_access(api_key_id: int, assistant_id: int) -> bool:
-        """Check if an API key has access to an assistant."""
-        query = """
-            SELECT 1 FROM api_key_assistant 
-            WHERE api_key_id = $1 AND assistant_id = $2
-        """
-        result = await db_manager.fetch_one(query, api_key_id, assistant_id)
-        return result is not None
+    async def list_allowed_assistant_ids(api_key_id: int) -> List[int]:
+        """List IDs of assistants an API key has access to."""
+        query = "SELECT assistant_id FROM api_key_assistant WHERE api_key_id = $1"
+        rows = await db_manager.fetch_all(query, api_key_id)
+        return [row["assistant_id"] for row in rows]
     
     @staticmethod
     async def set_key_assistants(api_key_id: int, assistant_ids: List[int]) -> None:
         """Set assistants for an API key (replace all existing)."""
-        # First, remove all existing bindings
-        await db_manager.execute(
-            "DELETE FROM api_key_assistant WHERE api_key_id = $1",
-            api_key_id
-        )
-        
-        # Then add new bindings
-        if assistant_ids:
-            values = [(api_key_id, assistant_id) for assistant_id in assistant_ids]
-            await db_manager.execute_many(
-                "INSERT INTO api_key_assistant (api_key_id, assistant_id) VALUES ($1, $2)",
-                values
+        # 删除不在新列表中的绑定，并批量插入新绑定，一条语句完成
+        query = """
+            WITH removed AS (
+                DELETE FROM api_key_assistant
+                WHERE api_key_id = $1 AND assistant_id <> ALL($2::int[])
             )
+            INSERT INTO api_key_assistant (api_key_id, assistant_id)
+            SELECT $1, assistant_id FROM unnest($2::int[]) AS t(assistant_id)
+            ON CONFLICT (api_key_id, assistant_id) DO NOTHING
+        """
+        await db_manager.execute(query, api_key_id, list(assistant_ids or []))
 
 
 class APIKeyUsageLogQueries:
     """API Key usage log queries."""
     
+    USAGE_LOG_COLUMNS = [
+        "api_key_id", "endpoint", "assistant_id", "ip_address", "user_agent",
+        "request_size", "response_size", "status_code", "error_message", "created_at"
+    ]
+    
     @staticmethod
     async def log_usage(
         api_key_id: int,
@@ -269,41 +305,61 @@ class APIKeyUsageLogQueries:
         )
     
     @staticmethod
-    async def get_key_usage_stats(api_key_id: int, days: int = 30) -> Dict[str, Any]:
-        """Get usage statistics for an API key."""
+    async def log_usage_batch(records: List[tuple]) -> None:
+        """Log a batch of API key usage rows with COPY.
+        
+        Each record is a tuple ordered as ``USAGE_LOG_COLUMNS``.
+        """
+        await db_manager.copy_records_to_table(
+            "api_key_usage_log", records, APIKeyUsageLogQueries.USAGE_LOG_COLUMNS
+        )
+    
+    @staticmethod
+    async def get_key_usage_stats(api_key_id: int, days: int = 30) -> Optional[Dict[str, Any]]:
+        """Get usage statistics for an API key.
+        
+        The window is passed as a parameter rather than formatted into the SQL,
+        so each statement text stays constant and its prepared plan is reused.
+        
+        Returns:
+            Statistics dict, or None if the API key does not exist
+        """
         query = """
             SELECT 
+                EXISTS(SELECT 1 FROM api_key WHERE id = $1) as key_exists,
                 COUNT(*) as total_requests,
                 COUNT(*) FILTER (WHERE status_code < 400) as successful_requests,
                 COUNT(*) FILTER (WHERE status_code >= 400) as failed_requests,
                 MAX(created_at) as last_used_at
             FROM api_key_usage_log 
-            WHERE api_key_id = $1 AND created_at >= CURRENT_TIMESTAMP - INTERVAL '%s days'
+            WHERE api_key_id = $1 AND created_at >= CURRENT_TIMESTAMP - make_interval(days => $2)
         """
-        stats = await db_manager.fetch_one(query % days, api_key_id)
+        stats = await db_manager.fetch_one(query, api_key_id, days)
+        if not stats["key_exists"]:
+            return None
         
         # Get most used endpoint
         endpoint_query = """
             SELECT endpoint, COUNT(*) as count
             FROM api_key_usage_log 
-            WHERE api_key_id = $1 AND created_at >= CURRENT_TIMESTAMP - INTERVAL '%s days'
+            WHERE api_key_id = $1 AND created_at >= CURRENT_TIMESTAMP - make_interval(days => $2)
             GROUP BY endpoint
             ORDER BY count DESC
             LIMIT 1
         """
-        most_used_endpoint = await db_manager.fetch_one(endpoint_query % days, api_key_id)
+        most_used_endpoint = await db_manager.fetch_one(endpoint_query, api_key_id, days)
         
         # Get most used assistant
         assistant_query = """
             SELECT a.name, COUNT(*) as count
             FROM api_key_usage_log l
             JOIN assistant a ON l.assistant_id = a.id
-            WHERE l.api_key_id = $1 AND l.created_at >= CURRENT_TIMESTAMP - INTERVAL '%s days'
+            WHERE l.api_key_id = $1 AND l.created_at >= CURRENT_TIMESTAMP - make_interval(days => $2)
             GROUP BY a.name
             ORDER BY count DESC
             LIMIT 1
         """
-        most_used_assistant = await db_manager.fetch_one(assistant_query % days, api_key_id)
+        most_used_assistant = await db_manager.fetch_one(assistant_query, api_key_id, days)
         
         return {
             "total_requests": stats["total_requests"] or 0,
@@ -319,14 +375,30 @@ class APIKeyUsageLogQueries:
         api_key_id: int, 
         limit: int = 100, 
         offset: int = 0
-    ) -> List[Dict[str, Any]]:
-        """Get usage logs for an API key."""
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Get usage logs for an API key.
+        
+        Returns:
+            List of logs, or None if the API key does not exist
+        """
+        # Key 不存在时无行，存在但无日志时返回一行空值
         query = """
-            SELECT l.*, a.name as assistant_name
-            FROM api_key_usage_log l
+            SELECT l.id, l.api_key_id, l.endpoint, l.assistant_id,
+                   host(l.ip_address) as ip_address, l.user_agent,
+                   l.request_size, l.response_size, l.status_code,
+                   l.error_message, l.created_at, a.name as assistant_name
+            FROM api_key ak
+            LEFT JOIN LATERAL (
+                SELECT * FROM api_key_usage_log
+                WHERE api_key_id = ak.id
+                ORDER BY created_at DESC
+                LIMIT $2 OFFSET $3
+            ) l ON true
             LEFT JOIN assistant a ON l.assistant_id = a.id
-            WHERE l.api_key_id = $1
+            WHERE ak.id = $1
             ORDER BY l.created_at DESC
-            LIMIT $2 OFFSET $3
         """
-        return await db_manager.fetch_all(query, api_key_id, limit, offset)
+        rows = await db_manager.fetch_all(query, api_key_id, limit, offset)
+        if not rows:
+            return None
+        return [row for row in rows if row["id"] is not None]
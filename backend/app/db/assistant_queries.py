@@ -33,12 +33,36 @@ class AssistantQueries:
         query = "SELECT * FROM assistant WHERE id = $1"
         return await db_manager.fetch_one(query, assistant_id)
     
+    @staticmethod
+    async def get_assistants_by_ids(assistant_ids: List[int]) -> List[Dict[str, Any]]:
+        """Get assistants by a list of IDs."""
+        query = "SELECT * FROM assistant WHERE id = ANY($1::int[])"
+        return await db_manager.fetch_all(query, list(assistant_ids))
+    
+    @staticmethod
+    async def exists(assistant_id: int) -> bool:
+        """Check whether an assistant exists."""
+        query = "SELECT EXISTS(SELECT 1 FROM assistant WHERE id = $1)"
+        return await db_manager.fetch_val(query, assistant_id)
+    
     @staticmethod
     async def get_assistant_by_name(name: str) -> Optional[Dict[str, Any]]:
         """Get assistant by name."""
         query = "SELECT * FROM assistant WHERE name = $1"
         return await db_manager.fetch_one(query, name)
     
+    @staticmethod
+    async def get_enabled_assistant_by_name_ci(name: str) -> Optional[Dict[str, Any]]:
+        """Get an enabled assistant by name, preferring an exact match over a case-insensitive one."""
+        # 走 LOWER(name) 函数索引；大小写不同的多个同名助手中取最新创建的
+        query = """
+            SELECT * FROM assistant
+            WHERE LOWER(name) = LOWER($1) AND enabled = true
+            ORDER BY name = $1 DESC, created_at DESC
+            LIMIT 1
+        """
+        return await db_manager.fetch_one(query, name)
+    
     @staticmethod
     async def list_assistants(enabled_only: bool = False) -> List[Dict[str, Any]]:
         """List all assistants."""
@@ -49,7 +73,7 @@ class AssistantQueries:
         return await db_manager.fetch_all(query)
     
     @staticmethod
-    async def update_assistant(
+    def _build_update(
         assistant_id: int,
         name: str = None,
         description: str = None,
@@ -57,8 +81,12 @@ class AssistantQueries:
         intent_model: str = None,
         max_tools: int = None,
         enabled: bool = None
-    ) -> Optional[Dict[str, Any]]:
-        """Update assistant."""
+    ) -> Optional[tuple[str, List[Any]]]:
+        """Build the UPDATE ... RETURNING * statement for an assistant.
+        
+        Returns:
+            tuple: (query, params), or None if there is nothing to update
+        """
         updates = []
         params = []
         param_count = 1
@@ -94,7 +122,7 @@ class AssistantQueries:
             param_count += 1
         
         if not updates:
-            return await AssistantQueries.get_assistant_by_id(assistant_id)
+            return None
         
         updates.append("updated_at = CURRENT_TIMESTAMP")
         params.append(assistant_id)
@@ -105,7 +133,109 @@ class AssistantQueries:
             WHERE id = ${param_count}
             RETURNING *
         """
+        return query, params
+    
+    @staticmethod
+    async def update_assistant(assistant_id: int, **fields: Any) -> Optional[Dict[str, Any]]:
+        """Update assistant."""
+        update = AssistantQueries._build_update(assistant_id, **fields)
+        if not update:
+            return await AssistantQueries.get_assistant_by_id(assistant_id)
         
+        query, params = update
+        return await db_manager.fetch_one(query, *params)
+    
+    @staticmethod
+    async def update_assistant_with_tools(assistant_id: int, **fields: Any) -> Optional[Dict[str, Any]]:
+        """Update assistant and return it with its tools in one round trip."""
+        update = AssistantQueries._build_update(assistant_id, **fields)
+        if not update:
+            return await AssistantQueries.get_assistant_with_tools(assistant_id)
+        
+        update_query, params = update
+        query = f"""
+            WITH upd AS ({update_query})
+            SELECT upd.*,
+                   (
+                       SELECT COALESCE(
+                           json_agg(
+                               json_build_object(
+                                   'id', t.id,
+                                   'name', t.name,
+                                   'description', t.description,
+                                   'connection_type', t.connection_type,
+                                   'priority', at.priority
+                               )
+                               ORDER BY at.priority NULLS LAST, t.id
+                           ),
+                           '[]'::json
+                       )
+                       FROM assistant_tool at
+                       JOIN mcp_tool t ON at.tool_id = t.id AND t.enabled = true
+                       WHERE at.assistant_id = upd.id
+                   ) as tools
+            FROM upd
+        """
+        return await db_manager.fetch_one(query, *params)
+    
+    @staticmethod
+    async def update_assistant_and_tools(
+        assistant_id: int,
+        tool_ids: List[int],
+        **fields: Any
+    ) -> Optional[Dict[str, Any]]:
+        """Update assistant, replace its tools and return it with its tools.
+        
+        Runs as a single statement, so the update and the tool bindings are
+        applied atomically in one round trip. Returns None if the assistant
+        does not exist.
+        """
+        update = AssistantQueries._build_update(assistant_id, **fields)
+        if update:
+            update_query, params = update
+        else:
+            # 没有字段要更新时锁定该行，与并发的更新串行化
+            update_query, params = "SELECT * FROM assistant WHERE id = $1 FOR UPDATE", [assistant_id]
+        # 去重并保持顺序，顺序即优先级
+        params.append(list(dict.fromkeys(tool_ids)))
+        tool_ids_param = f"${len(params)}::int[]"
+        
+        # 同一语句内各 CTE 看到的是同一快照，返回的工具从 ins 的结果中取
+        query = f"""
+            WITH upd AS ({update_query}),
+            removed AS (
+                DELETE FROM assistant_tool at
+                USING upd
+                WHERE at.assistant_id = upd.id AND at.tool_id <> ALL({tool_ids_param})
+            ),
+            ins AS (
+                INSERT INTO assistant_tool (assistant_id, tool_id, priority)
+                SELECT upd.id, t.tool_id, t.priority
+                FROM upd, unnest({tool_ids_param}) WITH ORDINALITY AS t(tool_id, priority)
+                ON CONFLICT (assistant_id, tool_id) DO UPDATE
+                SET priority = EXCLUDED.priority
+                RETURNING tool_id, priority
+            )
+            SELECT upd.*,
+                   (
+                       SELECT COALESCE(
+                           json_agg(
+                               json_build_object(
+                                   'id', t.id,
+                                   'name', t.name,
+                                   'description', t.description,
+                                   'connection_type', t.connection_type,
+                                   'priority', ins.priority
+                               )
+                               ORDER BY ins.priority, t.id
+                           ),
+                           '[]'::json
+                       )
+                       FROM ins
+                       JOIN mcp_tool t ON ins.tool_id = t.id AND t.enabled = true
+                   ) as tools
+            FROM upd
+        """
         return await db_manager.fetch_one(query, *params)
     
     @staticmethod
@@ -129,6 +259,7 @@ class AssistantQueries:
                                'connection_type', t.connection_type,
                                'priority', at.priority
                            )
+                           ORDER BY at.priority NULLS LAST, t.id
                        ) FILTER (WHERE t.id IS NOT NULL),
                        '[]'::json
                    ) as tools
@@ -138,18 +269,8 @@ class AssistantQueries:
             WHERE a.id = $1
             GROUP BY a.id
         """
-        result = await db_manager.fetch_one(query, assistant_id)
-        
-        # 确保 tools 字段是一个 Python 列表
-        if result and 'tools' in result:
-            import json
-            if isinstance(result['tools'], str):
-                try:
-                    result['tools'] = json.loads(result['tools'])
-                except json.JSONDecodeError:
-                    result['tools'] = []
-        
-        return result
+        # json 列由连接上注册的 codec 解码，tools 直接是 Python 列表
+        return await db_manager.fetch_one(query, assistant_id)
 
 
 class AssistantToolQueries:
@@ -161,13 +282,32 @@ class AssistantToolQueries:
         tool_id: int, 
         priority: int = 1
     ) -> Dict[str, Any]:
-        """Add a tool to an assistant."""
+        """Add a tool to a dedicated assistant.
+        
+        Returns:
+            dict with ``assistant_type`` (None if the assistant does not exist),
+            ``tool_exists`` and ``added``; the tool is only added when the
+            assistant is dedicated and the tool exists.
+        """
+        # 存在性检查、类型检查和插入合并为一条语句
         query = """
-            INSERT INTO assistant_tool (assistant_id, tool_id, priority)
-            VALUES ($1, $2, $3)
-            ON CONFLICT (assistant_id, tool_id) DO UPDATE
-            SET priority = $3
-            RETURNING *
+            WITH a AS (
+                SELECT type FROM assistant WHERE id = $1
+            ), t AS (
+                SELECT EXISTS(SELECT 1 FROM mcp_tool WHERE id = $2) AS tool_exists
+            ), ins AS (
+                INSERT INTO assistant_tool (assistant_id, tool_id, priority)
+                SELECT $1, $2, $3
+                FROM a, t
+                WHERE a.type = 'dedicated' AND t.tool_exists
+                ON CONFLICT (assistant_id, tool_id) DO UPDATE
+                SET priority = $3
+                RETURNING 1
+            )
+            SELECT
+                (SELECT type FROM a) AS assistant_type,
+                (SELECT tool_exists FROM t) AS tool_exists,
+                EXISTS(SELECT 1 FROM ins) AS added
         """
         return await db_manager.fetch_one(query, assistant_id, tool_id, priority)
     
@@ -190,6 +330,19 @@ class AssistantToolQueries:
         """
         return await db_manager.fetch_all(query, assistant_id)
     
+    @staticmethod
+    async def get_assistant_tool_ids(assistant_id: int) -> List[int]:
+        """Get IDs of the enabled tools of an assistant, sorted by priority."""
+        query = """
+            SELECT at.tool_id
+            FROM assistant_tool at
+            JOIN mcp_tool t ON at.tool_id = t.id
+            WHERE at.assistant_id = $1 AND t.enabled = true
+            ORDER BY at.priority NULLS LAST, at.tool_id
+        """
+        rows = await db_manager.fetch_all(query, assistant_id)
+        return [row["tool_id"] for row in rows]
+    
     @staticmethod
     async def set_assistant_tools(
         assistant_id: int, 
@@ -7,6 +7,7 @@ from typing import Optional, Any, Dict, List
 from contextlib import asynccontextmanager
 
 import asyncpg
+import orjson
 from asyncpg import Pool, Connection
 
 from app.config import settings
@@ -19,17 +20,36 @@ class DatabaseManager:
     
     def __init__(self):
         self._pool: Optional[Pool] = None
+        self.server_version: Optional[str] = None  # 进程生命周期内不变，连接时获取一次
+    
+    @staticmethod
+    async def _init_connection(conn: Connection) -> None:
+        """Register type codecs on each new pooled connection."""
+        # json 类型（如 json_agg 的结果）直接解码为 Python 对象
+        await conn.set_type_codec(
+            "json",
+            encoder=lambda value: orjson.dumps(value).decode(),
+            decoder=orjson.loads,
+            schema="pg_catalog",
+        )
     
     async def connect(self) -> None:
         """Create database connection pool."""
         try:
             self._pool = await asyncpg.create_pool(
                 settings.database_url,
-                min_size=1,
-                max_size=10,
-                command_timeout=60,
+                min_size=settings.database_pool_min_size,
+                max_size=settings.database_pool_max_size,
+                timeout=settings.database_connect_timeout,
+                command_timeout=settings.database_command_timeout,
+                statement_cache_size=settings.database_statement_cache_size,
+                init=self._init_connection,
+            )
+            logger.info(
+                f"Database connection pool created "
+                f"({self._pool.get_size()} connections warmed)"
             )
-            logger.info("Database connection pool created")
+            self.server_version = await self.fetch_val("SELECT version()")
         except Exception as e:
             logger.error(f"Failed to create database pool: {e}")
             raise
@@ -46,7 +66,7 @@ class DatabaseManager:
         if not self._pool:
             raise RuntimeError("Database pool not initialized")
         
-        async with self._pool.acquire() as connection:
+        async with self._pool.acquire(timeout=settings.database_pool_acquire_timeout) as connection:
             yield connection
     
     async def execute(self, query: str, *args) -> str:
@@ -76,6 +96,13 @@ class DatabaseManager:
         async with self.get_connection() as conn:
             await conn.executemany(query, args_list)
     
+    async def copy_records_to_table(
+        self, table_name: str, records: List[tuple], columns: List[str]
+    ) -> None:
+        """Bulk insert rows using the COPY protocol."""
+        async with self.get_connection() as conn:
+            await conn.copy_records_to_table(table_name, records=records, columns=columns)
+    
     async def transaction(self):
         """Get transaction context manager."""
         if not self._pool:
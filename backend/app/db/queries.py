@@ -1,8 +1,9 @@
 """
 Database queries for MCP Connector.
 """
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, List, Dict, Any, Optional, Set
 import json
+import orjson
 from app.db.connection import db_manager
 
 
@@ -16,36 +17,36 @@ def parse_mcp_tool_json_fields(result: Dict[str, Any]) -> Dict[str, Any]:
     # Parse args field
     if result.get('args') and isinstance(result['args'], str):
         try:
-            result['args'] = json.loads(result['args'])
-        except (json.JSONDecodeError, TypeError):
+            result['args'] = orjson.loads(result['args'])
+        except (orjson.JSONDecodeError, TypeError):
             result['args'] = []
     
     # Parse env field
     if result.get('env') and isinstance(result['env'], str):
         try:
-            result['env'] = json.loads(result['env'])
-        except (json.JSONDecodeError, TypeError):
+            result['env'] = orjson.loads(result['env'])
+        except (orjson.JSONDecodeError, TypeError):
             result['env'] = {}
     
     # Parse headers field
     if result.get('headers') and isinstance(result['headers'], str):
         try:
-            result['headers'] = json.loads(result['headers'])
-        except (json.JSONDecodeError, TypeError):
+            result['headers'] = orjson.loads(result['headers'])
+        except (orjson.JSONDecodeError, TypeError):
             result['headers'] = {}
     
     # Parse auto_approve field
     if result.get('auto_approve') and isinstance(result['auto_approve'], str):
         try:
-            result['auto_approve'] = json.loads(result['auto_approve'])
-        except (json.JSONDecodeError, TypeError):
+            result['auto_approve'] = orjson.loads(result['auto_approve'])
+        except (orjson.JSONDecodeError, TypeError):
             result['auto_approve'] = []
     
     # Parse groups field
     if result.get('groups') and isinstance(result['groups'], str):
         try:
-            result['groups'] = json.loads(result['groups'])
-        except (json.JSONDecodeError, TypeError):
+            result['groups'] = orjson.loads(result['groups'])
+        except (orjson.JSONDecodeError, TypeError):
             result['groups'] = []
     
     return result
@@ -100,6 +101,62 @@ class MCPToolQueries:
         
         return parse_mcp_tool_json_fields(result)
     
+    @staticmethod
+    async def create_tools_bulk(tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Create multiple MCP tools with a single INSERT.
+        
+        Each item takes the same keys as ``create_tool`` arguments (without
+        ``group_ids``). The statement is atomic: either all tools are created
+        or none are.
+        """
+        if not tools:
+            return []
+        
+        def dump(value):
+            return json.dumps(value) if value else None
+        
+        # 按列组织成数组，通过 unnest 一次性插入所有行
+        query = """
+            INSERT INTO mcp_tool (
+                name, description, connection_type,
+                command, args, env, url, headers, timeout, retry_count, retry_delay,
+                disabled, auto_approve, enabled
+            )
+            SELECT name, description, connection_type,
+                   command, args::jsonb, env::jsonb, url, headers::jsonb,
+                   timeout, retry_count, retry_delay,
+                   disabled, auto_approve::jsonb, enabled
+            FROM unnest(
+                $1::text[], $2::text[], $3::text[],
+                $4::text[], $5::text[], $6::text[], $7::text[], $8::text[],
+                $9::int[], $10::int[], $11::int[],
+                $12::bool[], $13::text[], $14::bool[]
+            ) AS t(
+                name, description, connection_type,
+                command, args, env, url, headers, timeout, retry_count, retry_delay,
+                disabled, auto_approve, enabled
+            )
+            RETURNING *
+        """
+        results = await db_manager.fetch_all(
+            query,
+            [tool["name"] for tool in tools],
+            [tool.get("description") for tool in tools],
+            [tool["connection_type"] for tool in tools],
+            [tool.get("command") for tool in tools],
+            [dump(tool.get("args")) for tool in tools],
+            [dump(tool.get("env")) for tool in tools],
+            [tool.get("url") for tool in tools],
+            [dump(tool.get("headers")) for tool in tools],
+            [tool.get("timeout", 30) for tool in tools],
+            [tool.get("retry_count", 3) for tool in tools],
+            [tool.get("retry_delay", 5) for tool in tools],
+            [tool.get("disabled", False) for tool in tools],
+            [dump(tool.get("auto_approve")) for tool in tools],
+            [tool.get("enabled", True) for tool in tools],
+        )
+        return [parse_mcp_tool_json_fields(result) for result in results]
+    
     @staticmethod
     async def get_tool_by_id(tool_id: int) -> Optional[Dict[str, Any]]:
         """Get MCP tool by ID with its groups."""
@@ -124,6 +181,25 @@ class MCPToolQueries:
         results = await db_manager.fetch_all(query)
         return [parse_mcp_tool_json_fields(result) for result in results]
     
+    @staticmethod
+    async def get_existing_names_lower(candidate_names: List[str]) -> Set[str]:
+        """Get lowercased names of existing tools that may clash with the candidates.
+        
+        Matches each candidate exactly and with a ``-<n>`` suffix, which is
+        how duplicate names are renamed on import.
+        """
+        if not candidate_names:
+            return set()
+        
+        query = """
+            SELECT DISTINCT LOWER(t.name) AS name
+            FROM mcp_tool t
+            JOIN unnest($1::text[]) AS c(name)
+              ON LOWER(t.name) = c.name OR LOWER(t.name) LIKE c.name || '-%'
+        """
+        results = await db_manager.fetch_all(query, [name.lower() for name in candidate_names])
+        return {result["name"] for result in results}
+    
     @staticmethod
     async def list_all_tools(enabled_only: bool = True) -> List[Dict[str, Any]]:
         """List all tools with optional filtering and their groups."""
@@ -139,6 +215,24 @@ class MCPToolQueries:
         results = await db_manager.fetch_all(query)
         return [parse_mcp_tool_json_fields(result) for result in results]
     
+    @staticmethod
+    async def iter_tools_for_export() -> AsyncIterator[Dict[str, Any]]:
+        """Iterate over all tools with a server-side cursor, newest first.
+        
+        Only the columns needed for the MCP servers config are selected.
+        """
+        query = """
+            SELECT name, connection_type, command, args, env, url,
+                   auto_approve, disabled, enabled
+            FROM mcp_tool
+            ORDER BY created_at DESC
+        """
+        # 游标必须在事务内使用；按批次拉取，内存占用与工具总数无关
+        async with db_manager.get_connection() as conn:
+            async with conn.transaction():
+                async for row in conn.cursor(query):
+                    yield parse_mcp_tool_json_fields(row)
+    
     @staticmethod
     async def update_tool(
         tool_id: int,
@@ -158,7 +252,11 @@ class MCPToolQueries:
         enabled: bool = None,
         group_ids: List[int] = None
     ) -> Optional[Dict[str, Any]]:
-        """Update MCP tool."""
+        """Update MCP tool.
+        
+        Returns:
+            Updated tool, or None if the tool does not exist
+        """
         updates = []
         params = []
         param_count = 1
@@ -233,23 +331,22 @@ class MCPToolQueries:
             params.append(enabled)
             param_count += 1
         
-        # Update tool fields if any
-        if updates:
-            updates.append("updated_at = CURRENT_TIMESTAMP")
-            params.append(tool_id)
-            
-            query = f"""
-                UPDATE mcp_tool 
-                SET {', '.join(updates)}
-                WHERE id = ${param_count}
-            """
-            
-            await db_manager.execute(query, *params)
-    
-            
-  
+        # 没有需要更新的字段时直接返回当前记录
+        if not updates:
+            return await MCPToolQueries.get_tool_by_id(tool_id)
         
-        return await MCPToolQueries.get_tool_by_id(tool_id)
+        updates.append("updated_at = CURRENT_TIMESTAMP")
+        params.append(tool_id)
+        
+        # 更新和读取在同一条语句中完成，工具不存在时返回 None
+        query = f"""
+            UPDATE mcp_tool 
+            SET {', '.join(updates)}
+            WHERE id = ${param_count}
+            RETURNING *
+        """
+        result = await db_manager.fetch_one(query, *params)
+        return parse_mcp_tool_json_fields(result)
     
     @staticmethod
     async def delete_tool(tool_id: int) -> bool:
@@ -10,8 +10,9 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 from app.config import settings
 from app.db.connection import db_manager
@@ -36,7 +37,9 @@ async def lifespan(app: FastAPI):
     global cleanup_task
     
     # Startup
-    logger.info("Starting MCP Connector...")
+    # 记录实际使用的事件循环，便于确认 uvloop 是否生效
+    loop = asyncio.get_running_loop()
+    logger.info(f"Starting MCP Connector on {type(loop).__module__}.{type(loop).__name__}...")
     await db_manager.connect()
     
     # Start agent cleanup task
@@ -44,6 +47,10 @@ async def lifespan(app: FastAPI):
     cleanup_task = asyncio.create_task(cleanup_idle_agents_task())
     logger.info("Started agent cleanup background task")
     
+    # Start usage log flush task
+    from app.core.usage_log_buffer import usage_log_buffer
+    usage_log_buffer.start()
+    
     logger.info("MCP Connector started successfully")
     
     yield
@@ -59,6 +66,9 @@ async def lifespan(app: FastAPI):
         except asyncio.CancelledError:
             pass
     
+    # Flush pending usage logs before the pool closes
+    await usage_log_buffer.stop()
+    
     await db_manager.disconnect()
     logger.info("MCP Connector shut down successfully")
 
@@ -70,6 +80,7 @@ app = FastAPI(
     description="MCP (Model Context Protocol) 服务端集合管理工具",
     lifespan=lifespan,
     debug=settings.app_debug,
+    default_response_class=ORJSONResponse,
 )
 
 # Add CORS middleware
@@ -81,6 +92,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(Exception)
+async def unhandled_exception_handler(request: Request, exc: Exception):
+    """Log unexpected errors and return a generic 500 without leaking details."""
+    logger.error(f"Unhandled error on {request.method} {request.url.path}: {exc}", exc_info=exc)
+    return ORJSONResponse(status_code=500, content={"detail": "Internal server error"})
+
+
 # Include routers
 app.include_router(health.router, prefix="/api/v1", tags=["health"])
 
@@ -109,10 +127,6 @@ app.include_router(openai_compatible.router, prefix="/api/v1", tags=["openai-com
 from app.api.v1 import sessions
 app.include_router(sessions.router, prefix="/api/v1", tags=["sessions"])
 
-# Import and include my assistants router
-from app.api.v1 import my_assistants
-app.include_router(my_assistants.router, prefix="/api/v1", tags=["my-assistants"])
-
 
 @app.get("/")
 async def root():
@@ -131,5 +145,6 @@ if __name__ == "__main__":
         host=settings.app_host,
         port=settings.app_port,
         reload=settings.app_debug,
-        log_level=settings.app_log_level.lower()
+        log_level=settings.app_log_level.lower(),
+        loop=settings.app_loop
     )
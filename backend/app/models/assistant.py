@@ -5,6 +5,7 @@ from datetime import datetime
 from typing import Optional, List, Dict, Any
 from enum import Enum
 
+import orjson
 from pydantic import BaseModel, Field
 
 
@@ -73,11 +74,10 @@ class AssistantWithTools(Assistant):
         """确保 tools 字段是一个列表"""
         if isinstance(obj, dict) and 'tools' in obj:
             if not isinstance(obj['tools'], list):
-                import json
                 if isinstance(obj['tools'], str):
                     try:
-                        obj['tools'] = json.loads(obj['tools'])
-                    except json.JSONDecodeError:
+                        obj['tools'] = orjson.loads(obj['tools'])
+                    except orjson.JSONDecodeError:
                         obj['tools'] = []
                 else:
                     obj['tools'] = []
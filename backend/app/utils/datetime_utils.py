@@ -48,3 +48,35 @@ def parse_datetime(dt_str: Optional[str]) -> Optional[datetime]:
                 
         # 如果所有尝试都失败，抛出异常
         raise ValueError(f"无法解析日期时间字符串: {dt_str}")
+
+
+def to_timestamp(dt: Optional[datetime]) -> Optional[float]:
+    """
+    将 datetime 转换为 Unix 时间戳，不带时区信息的按 UTC 处理
+    
+    Args:
+        dt: datetime 对象或 None
+        
+    Returns:
+        Unix 时间戳或 None（如果输入为 None）
+    """
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def format_timestamp(ts: Optional[float]) -> Optional[str]:
+    """
+    将 Unix 时间戳格式化为不带时区信息的 UTC ISO 字符串，与 datetime.utcnow().isoformat() 一致
+    
+    Args:
+        ts: Unix 时间戳或 None
+        
+    Returns:
+        ISO 格式字符串或 None（如果输入为 None）
+    """
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None).isoformat()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Add the lookup indexes from plan/database_schema.sql to an existing database.
+
+init_db.py only applies the schema on a fresh install, so databases created
+before these indexes were added need this migration. It is safe to run more
+than once.
+"""
+import asyncio
+import logging
+import sys
+from pathlib import Path
+
+import asyncpg
+
+# Add parent directory to path to import app modules
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 工具列表按 enabled 过滤并按创建时间排序
+MCP_TOOL_ENABLED_INDEX = (
+    "CREATE INDEX idx_mcp_tool_enabled ON mcp_tool(enabled, created_at DESC)"
+)
+
+NEW_INDEXES = [
+    # 批量导入时按名称（不区分大小写）检查重名
+    "CREATE INDEX IF NOT EXISTS idx_mcp_tool_name_lower ON mcp_tool(LOWER(name) text_pattern_ops)",
+    # OpenAI 兼容接口按模型名（不区分大小写）查找助手
+    "CREATE INDEX IF NOT EXISTS idx_assistant_name_lower ON assistant(LOWER(name))",
+]
+
+
+async def migrate():
+    """Create the missing indexes and widen idx_mcp_tool_enabled."""
+    conn = await asyncpg.connect(settings.database_url)
+    try:
+        async with conn.transaction():
+            for statement in NEW_INDEXES:
+                await conn.execute(statement)
+
+            # 旧库中的 idx_mcp_tool_enabled 只有 enabled 一列，删除后按新定义重建
+            indexdef = await conn.fetchval(
+                "SELECT indexdef FROM pg_indexes WHERE indexname = 'idx_mcp_tool_enabled'"
+            )
+            if indexdef is None or "created_at" not in indexdef:
+                await conn.execute("DROP INDEX IF EXISTS idx_mcp_tool_enabled")
+                await conn.execute(MCP_TOOL_ENABLED_INDEX)
+                logger.info("Rebuilt idx_mcp_tool_enabled on (enabled, created_at DESC)")
+            else:
+                logger.info("idx_mcp_tool_enabled is already up to date")
+
+        logger.info("Lookup indexes are in place")
+    finally:
+        await conn.close()
+
+
+async def main():
+    """Main function."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+
+    try:
+        await migrate()
+    except Exception as e:
+        logger.error(f"Index migration failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
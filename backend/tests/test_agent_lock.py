@@ -0,0 +1,54 @@
+"""
+Shared agent serialization tests.
+"""
+import asyncio
+import threading
+import time
+
+import orjson
+import pytest
+
+from app.api.v1.openai_compatible import ChatCompletionRequest, Message, regular_chat_completion
+
+
+class FakeAgent:
+    """Synchronous agent that records how many calls run at once."""
+    
+    def __init__(self):
+        self.messages = []
+        self.active = 0
+        self.max_active = 0
+        self._guard = threading.Lock()
+    
+    def __call__(self, prompt: str) -> str:
+        with self._guard:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        # 模拟模型调用耗时，让并发请求有机会重叠
+        time.sleep(0.05)
+        self.messages.append(prompt)
+        with self._guard:
+            self.active -= 1
+        return f"reply to {prompt}"
+
+
+def make_request(content: str) -> ChatCompletionRequest:
+    return ChatCompletionRequest(model="test", messages=[Message(role="user", content=content)])
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_to_shared_agent_are_serialized():
+    """Two requests on the same cached agent never run it at the same time."""
+    agent = FakeAgent()
+    assistant = {"id": 1}
+    
+    responses = await asyncio.gather(
+        regular_chat_completion(make_request("first"), assistant, agent, "missing-session"),
+        regular_chat_completion(make_request("second"), assistant, agent, "missing-session"),
+    )
+    
+    assert agent.max_active == 1
+    assert len(agent.messages) == 2
+    contents = [orjson.loads(r.body)["choices"][0]["message"]["content"] for r in responses]
+    assert all(content.startswith("reply to ") for content in contents)
+    assert contents[0] != contents[1]
@@ -0,0 +1,78 @@
+"""
+Session cache index tests.
+"""
+from app.core.agent_manager import _SessionCache
+
+
+class FakeTimer:
+    """Manually advanced clock for TTL tests."""
+    
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_session(user_id):
+    return {"user_id": user_id, "messages": []}
+
+
+def test_index_tracks_inserts():
+    """Sessions are indexed by user_id as they are inserted."""
+    cache = _SessionCache(maxsize=10, ttl=60)
+    cache["s1"] = make_session("u1")
+    cache["s2"] = make_session("u1")
+    cache["s3"] = make_session("u2")
+    assert cache.by_user == {"u1": {"s1", "s2"}, "u2": {"s3"}}
+
+
+def test_index_drops_expired_sessions():
+    """Sessions removed by expire() leave the index."""
+    timer = FakeTimer()
+    cache = _SessionCache(maxsize=10, ttl=60, timer=timer)
+    cache["s1"] = make_session("u1")
+    timer.now = 30
+    cache["s2"] = make_session("u1")
+    
+    timer.now = 70
+    cache.expire()
+    assert cache.by_user == {"u1": {"s2"}}
+    
+    timer.now = 100
+    cache.expire()
+    assert cache.by_user == {}
+
+
+def test_index_drops_sessions_expired_on_insert():
+    """Expired sessions purged while inserting another one leave the index."""
+    timer = FakeTimer()
+    cache = _SessionCache(maxsize=10, ttl=60, timer=timer)
+    cache["s1"] = make_session("u1")
+    timer.now = 61
+    cache["s2"] = make_session("u2")
+    assert "s1" not in cache
+    assert cache.by_user == {"u2": {"s2"}}
+
+
+def test_index_drops_lru_evicted_sessions():
+    """The least recently used session evicted at capacity leaves the index."""
+    cache = _SessionCache(maxsize=2, ttl=60)
+    cache["s1"] = make_session("u1")
+    cache["s2"] = make_session("u1")
+    # 重新写入 s1 刷新其使用顺序，容量满时淘汰 s2
+    cache["s1"] = cache["s1"]
+    cache["s3"] = make_session("u2")
+    assert set(cache) == {"s1", "s3"}
+    assert cache.by_user == {"u1": {"s1"}, "u2": {"s3"}}
+
+
+def test_index_drops_removed_and_cleared_sessions():
+    """Explicit removal and clear() keep the index in sync."""
+    cache = _SessionCache(maxsize=10, ttl=60)
+    cache["s1"] = make_session("u1")
+    cache["s2"] = make_session("u1")
+    cache.pop("s1")
+    assert cache.by_user == {"u1": {"s2"}}
+    cache.clear()
+    assert cache.by_user == {}
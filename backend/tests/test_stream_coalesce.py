@@ -0,0 +1,112 @@
+"""
+Streaming text coalescing tests.
+"""
+import asyncio
+
+import pytest
+
+from app.api.v1.openai_compatible import coalesce_stream_text
+from app.config import settings
+
+
+async def events_from(*items, delay: float = 0):
+    """Yield text delta events, optionally sleeping before each one."""
+    for item in items:
+        if delay:
+            await asyncio.sleep(delay)
+        yield {"data": item}
+
+
+async def collect(events):
+    """Collect all pieces produced by coalesce_stream_text."""
+    return [piece async for piece in coalesce_stream_text(events)]
+
+
+@pytest.fixture
+def flush_settings(monkeypatch):
+    """Set the stream flush thresholds for a test."""
+    def apply(chars: int, interval: float):
+        monkeypatch.setattr(settings, "stream_flush_chars", chars)
+        monkeypatch.setattr(settings, "stream_flush_interval", interval)
+    return apply
+
+
+@pytest.mark.asyncio
+async def test_flushes_when_size_reached(flush_settings):
+    """Deltas are merged until the buffer reaches stream_flush_chars."""
+    flush_settings(5, 10)
+    pieces = await collect(events_from("ab", "cd", "ef", "g"))
+    assert pieces == ["abcdef", "g"]
+
+
+@pytest.mark.asyncio
+async def test_flushes_when_interval_elapses(flush_settings):
+    """A partial buffer is sent once the flush interval has passed."""
+    flush_settings(1000, 0.05)
+    produced = []
+    
+    async def slow_events():
+        produced.append("a")
+        yield {"data": "a"}
+        await asyncio.sleep(0.3)
+        produced.append("b")
+        yield {"data": "b"}
+    
+    pieces = []
+    async for piece in coalesce_stream_text(slow_events()):
+        # "a" must arrive before the source has produced "b"
+        pieces.append((piece, list(produced)))
+    assert pieces == [("a", ["a"]), ("b", ["a", "b"])]
+
+
+@pytest.mark.asyncio
+async def test_passthrough_when_flush_chars_is_zero(flush_settings):
+    """With stream_flush_chars=0 every delta is sent as it arrives."""
+    flush_settings(0, 10)
+    
+    async def mixed_events():
+        yield {"data": "a"}
+        yield {"event": "tool_use"}  # 非文本事件被忽略
+        yield {"data": ""}
+        yield {"data": "b"}
+        yield {"data": "c"}
+    
+    assert await collect(mixed_events()) == ["a", "b", "c"]
+
+
+@pytest.mark.asyncio
+async def test_error_after_partial_buffer_flushes_then_raises(flush_settings):
+    """Text buffered before an error is sent before the error propagates."""
+    flush_settings(1000, 10)
+    
+    async def failing_events():
+        yield {"data": "ab"}
+        yield {"data": "cd"}
+        raise RuntimeError("model failed")
+    
+    pieces = []
+    with pytest.raises(RuntimeError, match="model failed"):
+        async for piece in coalesce_stream_text(failing_events()):
+            pieces.append(piece)
+    assert pieces == ["abcd"]
+
+
+@pytest.mark.asyncio
+async def test_close_cancels_pending_read(flush_settings):
+    """Closing the stream early cancels the read still waiting on the source."""
+    flush_settings(1000, 0.01)
+    cancelled = asyncio.Event()
+    
+    async def stalled_events():
+        yield {"data": "a"}
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        yield {"data": "b"}
+    
+    stream = coalesce_stream_text(stalled_events())
+    assert await stream.__anext__() == "a"
+    await stream.aclose()
+    await asyncio.wait_for(cancelled.wait(), 1)
@@ -91,11 +91,16 @@ CREATE TABLE tool_vector (
 );
 
 -- 创建索引
-CREATE INDEX idx_mcp_tool_enabled ON mcp_tool(enabled);
+-- 工具列表按 enabled 过滤并按创建时间排序，复合索引可同时满足过滤和排序
+CREATE INDEX idx_mcp_tool_enabled ON mcp_tool(enabled, created_at DESC);
+-- 批量导入时按名称（不区分大小写）检查重名
+CREATE INDEX idx_mcp_tool_name_lower ON mcp_tool(LOWER(name) text_pattern_ops);
 CREATE INDEX idx_tool_status_tool_id ON tool_status(tool_id);
 CREATE INDEX idx_tool_status_status ON tool_status(status);
 CREATE INDEX idx_assistant_type ON assistant(type);
 CREATE INDEX idx_assistant_enabled ON assistant(enabled);
+-- OpenAI 兼容接口按模型名（不区分大小写）查找助手
+CREATE INDEX idx_assistant_name_lower ON assistant(LOWER(name));
 CREATE INDEX idx_assistant_tool_assistant_id ON assistant_tool(assistant_id);
 CREATE INDEX idx_assistant_tool_priority ON assistant_tool(priority);
 